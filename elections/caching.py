@@ -0,0 +1,88 @@
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.crypto import constant_time_compare
+
+from elex import config
+
+# fields of the logged in user kept in the cache
+USER_FIELDS = ['id', 'username', 'email', 'first_name', 'last_name', 'is_active', 'is_staff', 'is_superuser']
+
+# hits and misses of every cached value since the start of this process
+_hits = Counter()
+_misses = Counter()
+_lock = threading.Lock()
+
+
+def cached(name, key, fetch, timeout):
+    value = cache.get(key)
+    with _lock:
+        if value is None:
+            _misses[name] += 1
+        else:
+            _hits[name] += 1
+    if value is None:
+        value = fetch()
+        if value is not None:
+            cache.set(key, value, timeout)
+    return value
+
+
+def cache_stats():
+    with _lock:
+        return {name: {"hits": _hits[name], "misses": _misses[name]} for name in sorted(set(_hits) | set(_misses))}
+
+
+def user_key(user_id):
+    return 'user-%s' % user_id
+
+
+def profile_key(user_id):
+    return 'profile-%s' % user_id
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def clear_user(sender, instance, **kwargs):
+    # user changed (e.g. last login or password), fetch it again on the next request
+    cache.delete_many([user_key(instance.pk), profile_key(instance.pk)])
+
+
+def load_user(user_id):
+    user = User.objects.filter(pk=user_id).first()
+    if user is None:
+        return None
+    # only the fields used by the requests, not the password hash
+    values = {field: getattr(user, field) for field in USER_FIELDS}
+    values['session_hash'] = user.get_session_auth_hash()
+    return values
+
+
+def get_user(request):
+    # same checks as django.contrib.auth.get_user, but the user is fetched from the cache
+    try:
+        user_id = request.session[SESSION_KEY]
+        backend = request.session[BACKEND_SESSION_KEY]
+    except KeyError:
+        return AnonymousUser()
+    if backend not in settings.AUTHENTICATION_BACKENDS:
+        return AnonymousUser()
+
+    values = cached('user', user_key(user_id), lambda: load_user(user_id), config.USER_CACHE_TIMEOUT)
+    if values is None or not values['is_active']:
+        return AnonymousUser()
+    # session is invalid after the password has changed
+    session_hash = request.session.get(HASH_SESSION_KEY)
+    if not session_hash or not constant_time_compare(session_hash, values['session_hash']):
+        request.session.flush()
+        return AnonymousUser()
+    # the other fields (e.g. the password) are loaded when they are used, save() only writes the cached fields
+    fields = [field.attname for field in User._meta.concrete_fields if field.attname in USER_FIELDS]
+    return User.from_db(DEFAULT_DB_ALIAS, fields, [values[field] for field in fields])
@@ -0,0 +1,64 @@
+from django.core.cache import cache
+from django.core.signals import request_started
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.dispatch import receiver
+from django.template.loader import get_template
+
+from elex import config
+
+
+@receiver(request_started)
+def check_connections(**kwargs):
+    # persistent connections may have been closed by the database server in the meantime
+    if not config.DB_HEALTH_CHECKS:
+        return
+    for connection in connections.all():
+        if connection.connection is not None and not connection.is_usable():
+            # connected again on the next query
+            connection.close()
+
+
+def check_database():
+    with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+        cursor.execute('SELECT 1')
+
+
+def check_migrations():
+    executor = MigrationExecutor(connections[DEFAULT_DB_ALIAS])
+    plan = executor.migration_plan(executor.loader.graph.leaf_nodes())
+    if plan:
+        raise Exception('%d migrations not applied' % len(plan))
+
+
+def check_cache():
+    cache.set('selfcheck', 1, 10)
+    if cache.get('selfcheck') != 1:
+        raise Exception('value not stored')
+
+
+def check_templates():
+    from elections.reports import get_environment
+    get_template(config.EMAIL_TEMPLATE)
+    get_template(config.EMAIL_REMIND_TEMPLATE)
+    get_environment().get_template(config.REPORT_TEMPLATE)
+
+
+CHECKS = [
+    ('database', check_database),
+    ('migrations', check_migrations),
+    ('cache', check_cache),
+    ('templates', check_templates),
+]
+
+
+def run_checks():
+    # name and error (None if passed) of every check
+    results = []
+    for name, check in CHECKS:
+        try:
+            check()
+            results.append((name, None))
+        except Exception as e:
+            results.append((name, '%s: %s' % (type(e).__name__, e)))
+    return results
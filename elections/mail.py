@@ -0,0 +1,262 @@
+import datetime
+import html
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from smtplib import SMTPServerDisconnected
+from uuid import uuid4
+
+from django.core.mail import get_connection, EmailMultiAlternatives
+from django.db import connection, transaction
+from django.template.loader import get_template
+from django.utils import timezone
+from django.utils.html import strip_tags
+
+from elections.metrics import timed
+from elections.models import OutboxEmail
+from elex import config
+
+
+class RateLimiter:
+    def __init__(self, rate):
+        # maximum number of messages per second, 0 for no limit
+        self.rate = rate
+        self.next = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if self.rate <= 0:
+            return
+        with self.lock:
+            # reserve the next free slot and wait for it
+            now = time.monotonic()
+            slot = max(self.next, now)
+            self.next = slot + 1.0 / self.rate
+        time.sleep(slot - now)
+
+
+class ConnectionPool:
+    def __init__(self, size, messages_per_connection, rate):
+        self.size = size
+        self.messages_per_connection = messages_per_connection
+        self.limiter = RateLimiter(rate)
+        self.connections = queue.Queue()
+        for _ in range(size):
+            # connections are opened on first use
+            self.connections.put([get_connection(fail_silently=False), 0])
+
+    def send_over(self, connection, message):
+        backend, sent = connection
+        if sent >= self.messages_per_connection:
+            # mail server allows only a limited number of messages per connection
+            backend.close()
+            sent = 0
+        if sent == 0:
+            backend.open()
+        backend.send_messages([message])
+        connection[1] = sent + 1
+
+    def send(self, message):
+        self.limiter.wait()
+        connection = self.connections.get()
+        try:
+            try:
+                self.send_over(connection, message)
+            except SMTPServerDisconnected:
+                # server closed the idle connection, send once more over a new one
+                connection[0].close()
+                connection[1] = 0
+                self.send_over(connection, message)
+        except Exception:
+            # reconnect on next use
+            connection[0].close()
+            connection[1] = 0
+            raise
+        finally:
+            self.connections.put(connection)
+
+    def close(self):
+        # wait for all connections and close them, they are opened again on next use
+        connections = [self.connections.get() for _ in range(self.size)]
+        for connection in connections:
+            connection[0].close()
+            connection[1] = 0
+            self.connections.put(connection)
+
+
+_pool = None
+
+
+def get_pool():
+    global _pool
+    # the pool is reused by every batch (and election) of this process
+    if _pool is None:
+        _pool = ConnectionPool(config.EMAIL_CONNECTIONS, config.EMAIL_MESSAGES_PER_CONNECTION, config.EMAIL_RATE)
+    return _pool
+
+
+@timed('queue_emails')
+def queue_emails(voters, election, reminder=False):
+    # add an email for every voter to the outbox, they are sent by the send_emails command
+    OutboxEmail.objects.bulk_create([
+        OutboxEmail(election_id=election.id, email=voter.email, token=voter.token, reminder=reminder)
+        for voter in voters
+    ], batch_size=1000)
+
+
+def render_context(election, reminder, token, year):
+    subject = 'Wahl: ' + election.name
+
+    if reminder:
+        subject = 'Erinnerung - ' + subject
+        template = get_template(config.EMAIL_REMIND_TEMPLATE)
+    else:
+        template = get_template(config.EMAIL_TEMPLATE)
+
+    context = {
+        "election_name": election.name,
+        "token": token,
+        "owner_email": election.owner.email,
+        "year": year,
+        "hostname": config.HOSTNAME
+    }
+    return subject, template.render(context)
+
+
+def render_link(match):
+    url = match.group(2)
+    text = strip_tags(match.group(3)).strip()
+    # keep the target of the link, e.g. the voting link of the invitation
+    if not text or text == url:
+        return url
+    return '%s (%s)' % (match.group(3), url)
+
+
+def render_text(body):
+    # plain text version of the html body without styles, tags and empty lines
+    body = re.sub(r'<(style|script|head)\b.*?</\1>', '', body, flags=re.DOTALL | re.IGNORECASE)
+    body = re.sub(r'<a\s[^>]*?\bhref\s*=\s*(["\'])(.*?)\1[^>]*>(.*?)</a\s*>', render_link, body,
+                  flags=re.DOTALL | re.IGNORECASE)
+    lines = html.unescape(strip_tags(body)).splitlines()
+    return '\n'.join(line.strip() for line in lines if line.strip())
+
+
+class EmailTemplate:
+    def __init__(self, election, reminder, year):
+        self.election = election
+        self.reminder = reminder
+        self.year = year
+        # render the template once with a placeholder instead of the token
+        placeholder = 'TOKEN' + uuid4().hex.upper()
+        self.subject, body = render_context(election, reminder, placeholder, year)
+        self.html = body.split(placeholder)
+        # the text is derived from the html, it may contain the token less often (e.g. not in an image url)
+        self.text = render_text(body).split(placeholder)
+        # without placeholder the template changes the token, render every email then
+        self.compiled = len(self.html) > 1
+
+    def render(self, token):
+        if not self.compiled:
+            subject, body = render_context(self.election, self.reminder, token, self.year)
+            return body, render_text(body)
+        # only the token differs between the emails of an election
+        return token.join(self.html), token.join(self.text)
+
+
+_templates = {}
+
+
+def get_email_template(election, reminder, year):
+    key = (election.id, reminder, year)
+    if key not in _templates:
+        if len(_templates) >= 100:
+            # forget the templates of older elections
+            _templates.clear()
+        _templates[key] = EmailTemplate(election, reminder, year)
+    return _templates[key]
+
+
+def render_email(email, year):
+    template = get_email_template(email.election, email.reminder, year)
+    body, text = template.render(email.token)
+    msg = EmailMultiAlternatives(
+        subject=template.subject,
+        body=text,
+        to=[email.email],
+        reply_to=[email.election.owner.email]
+    )
+    msg.attach_alternative(body, 'text/html')
+    return msg
+
+
+def _failed(email, error, now):
+    email.attempts = email.attempts + 1
+    email.error = str(error)[:500]
+    if email.attempts >= config.EMAIL_MAX_ATTEMPTS:
+        # give up after too many attempts
+        email.status = OutboxEmail.FAILED
+    else:
+        # retry later, wait twice as long after every attempt
+        delay = config.EMAIL_RETRY_DELAY * 2 ** (email.attempts - 1)
+        email.next_attempt = now + datetime.timedelta(seconds=delay)
+    email.save(update_fields=['attempts', 'error', 'status', 'next_attempt'])
+
+
+def claim_emails(batch_size, now):
+    claimed_until = now + datetime.timedelta(seconds=config.EMAIL_CLAIM_TIMEOUT)
+    due = OutboxEmail.objects.filter(status=OutboxEmail.PENDING, next_attempt__lte=now).order_by('next_attempt', 'id')
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            # claim the next batch of emails which are due, emails locked by other workers are skipped
+            ids = list(due.select_for_update(skip_locked=True).values_list('id', flat=True)[:batch_size])
+            # the claimed emails are due again only if the worker does not record the result in time
+            OutboxEmail.objects.filter(id__in=ids).update(next_attempt=claimed_until)
+    else:
+        # without skip locked (e.g. mysql before 8.0.1) an email belongs to the worker whose update still finds it due
+        ids = [email_id for email_id in due.values_list('id', flat=True)[:batch_size]
+               if OutboxEmail.objects.filter(id=email_id, status=OutboxEmail.PENDING, next_attempt__lte=now)
+               .update(next_attempt=claimed_until)]
+    return list(OutboxEmail.objects.select_related('election__owner').filter(id__in=ids).order_by('id'))
+
+
+@timed('send_emails')
+def send_emails(batch_size=None):
+    if batch_size is None:
+        batch_size = config.EMAIL_BATCH_SIZE
+    now = timezone.now()
+    year = datetime.date.today().strftime("%Y")
+
+    # the smtp connections are not used within a transaction, so no rows stay locked while sending
+    emails = claim_emails(batch_size, now)
+    if len(emails) == 0:
+        return 0
+
+    messages = []
+    for email in emails:
+        if email.election.end_date is not None:
+            # links are useless after the election has ended
+            email.status = OutboxEmail.FAILED
+            email.error = 'Election has ended'
+            email.save(update_fields=['status', 'error'])
+        else:
+            messages.append((email, render_email(email, year)))
+
+    # send the messages in parallel over the connections of the pool
+    pool = get_pool()
+    with ThreadPoolExecutor(max_workers=config.EMAIL_CONNECTIONS) as executor:
+        futures = [(email, executor.submit(pool.send, message)) for email, message in messages]
+
+    sent = []
+    for email, future in futures:
+        if future.exception() is None:
+            sent.append(email.id)
+        else:
+            _failed(email, future.exception(), now)
+
+    # token is not needed anymore once the email is sent
+    OutboxEmail.objects.filter(id__in=sent)\
+        .update(status=OutboxEmail.SENT, sent_date=timezone.now(), token='')
+    # return number of processed emails
+    return len(emails)
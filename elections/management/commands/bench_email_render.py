@@ -0,0 +1,64 @@
+import datetime
+import json
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from elections.mail import EmailTemplate, render_context, render_email
+from elections.models import Election, OutboxEmail
+from elections.serializers import generate_token
+
+
+class Command(BaseCommand):
+    help = 'Measures the render time per email of an election'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--voters', type=int, default=10000)
+        parser.add_argument('--reminder', action='store_true')
+
+    def handle(self, *args, **options):
+        year = datetime.date.today().strftime("%Y")
+        # nothing is saved, the emails are only rendered
+        election = Election(id=1, name='Benchmark', owner=User(email='owner@example.com'))
+        emails = [
+            OutboxEmail(election=election, email='voter%d@example.com' % i,
+                        token=generate_token(election.id), reminder=options['reminder'])
+            for i in range(options['voters'])
+        ]
+
+        # render the whole template for every email
+        start = time.perf_counter()
+        for email in emails:
+            render_context(election, email.reminder, email.token, year)
+        full = time.perf_counter() - start
+
+        # compile the template once per election and fill in the tokens
+        start = time.perf_counter()
+        template = EmailTemplate(election, options['reminder'], year)
+        for email in emails:
+            template.render(email.token)
+        compiled = time.perf_counter() - start
+
+        # templates which change the token are rendered for every email (plus the plain text)
+        start = time.perf_counter()
+        fallback = EmailTemplate(election, options['reminder'], year)
+        fallback.compiled = False
+        for email in emails:
+            fallback.render(email.token)
+        fallback = time.perf_counter() - start
+
+        # complete messages including the plain text and html alternatives
+        start = time.perf_counter()
+        for email in emails:
+            render_email(email, year).message()
+        messages = time.perf_counter() - start
+
+        self.stdout.write(json.dumps({
+            'voters': options['voters'],
+            'compiled': template.compiled,
+            'full_render_us': full / max(len(emails), 1) * 1e6,
+            'compiled_render_us': compiled / max(len(emails), 1) * 1e6,
+            'fallback_render_us': fallback / max(len(emails), 1) * 1e6,
+            'message_us': messages / max(len(emails), 1) * 1e6,
+        }, indent=2))
@@ -0,0 +1,275 @@
+import datetime
+import json
+import os
+import queue
+import socketserver
+import statistics
+import tempfile
+import threading
+import time
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import override_settings, setup_databases, teardown_databases
+
+from elections import mail
+from elections.models import Election, Option, OutboxEmail, Voter
+from elections.serializers import generate_token
+from elex import config
+
+SCENARIOS = ['election_detail', 'voter_add', 'start', 'vote_get', 'vote_post', 'pdf_results']
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    # accepts every message and throws it away
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.reply('220 localhost benchmark')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.strip().upper()
+            if command.startswith(b'EHLO') or command.startswith(b'HELO'):
+                self.reply('250 localhost')
+            elif command == b'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                self.server.messages += 1
+                self.reply('250 OK')
+            elif command == b'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    messages = 0
+
+
+def measure(items, request, concurrency):
+    # send the requests from several threads, every thread with its own client and connection
+    items = list(items)
+    work = queue.Queue()
+    for item in items:
+        work.put(item)
+    times = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker():
+        client = None
+        try:
+            while True:
+                try:
+                    item = work.get_nowait()
+                except queue.Empty:
+                    return
+                if client is None:
+                    client = Client()
+                start = time.perf_counter()
+                try:
+                    ok = request(client, item)
+                except Exception as e:
+                    ok = False
+                    with lock:
+                        errors.append(repr(e))
+                elapsed = time.perf_counter() - start
+                with lock:
+                    times.append(elapsed)
+                    if not ok:
+                        errors.append(None)
+        finally:
+            connection.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(times, errors, time.perf_counter() - start)
+
+
+def summarize(times, errors, seconds):
+    times = sorted(times)
+    ret = {
+        'requests': len(times),
+        'errors': len(errors),
+        'seconds': round(seconds, 4),
+        'throughput': round(len(times) / seconds, 2) if seconds > 0 else None,
+    }
+    if times:
+        ret['mean_ms'] = round(statistics.mean(times) * 1000, 3)
+        ret['p50_ms'] = round(times[int(0.50 * (len(times) - 1))] * 1000, 3)
+        ret['p99_ms'] = round(times[int(0.99 * (len(times) - 1))] * 1000, 3)
+        ret['max_ms'] = round(times[-1] * 1000, 3)
+    examples = [error for error in errors if error is not None]
+    if examples:
+        ret['error_examples'] = examples[:3]
+    return ret
+
+
+class Command(BaseCommand):
+    help = 'Measures throughput and latency of the voting and admin APIs on a test database (output as json)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--options', type=int, default=5, help='options of the election')
+        parser.add_argument('--voters', type=int, default=1000, help='voters of the election')
+        parser.add_argument('--concurrency', type=int, default=8, help='number of parallel clients')
+        parser.add_argument('--requests', type=int, default=1000, help='requests of the read scenarios')
+        parser.add_argument('--batch', type=int, default=1000, help='voters added per request')
+        parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                            help='scenario to run (can be repeated), all by default')
+        parser.add_argument('--output', help='write the results to this file instead of stdout')
+        parser.add_argument('--keepdb', action='store_true', help='keep the test database')
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite' and not connection.settings_dict['TEST'].get('NAME'):
+            # a file instead of the in-memory database, so all threads use the same database
+            connection.settings_dict['TEST']['NAME'] = os.path.join(tempfile.gettempdir(), 'elex_benchmark.sqlite3')
+
+        # never run on the real database
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options['keepdb'])
+        smtp = SMTPServer(('127.0.0.1', 0), SMTPHandler)
+        threading.Thread(target=smtp.serve_forever, daemon=True).start()
+        try:
+            with override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                                   EMAIL_HOST='127.0.0.1', EMAIL_PORT=smtp.server_address[1],
+                                   EMAIL_USE_SSL=False, EMAIL_USE_TLS=False,
+                                   EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD=''):
+                results = self.run_scenarios(options, smtp)
+        finally:
+            smtp.shutdown()
+            smtp.server_close()
+            if mail._pool is not None:
+                mail._pool.close()
+                mail._pool = None
+            connections.close_all()
+            teardown_databases(old_config, verbosity=0, keepdb=options['keepdb'])
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def seed(self, options, name):
+        # election of the benchmark user with the requested number of options and voters
+        election = Election.objects.create(name=name, owner=self.user, votable=min(2, options['options']),
+                                           voters=options['voters'])
+        Option.objects.bulk_create([
+            Option(name='Option %d' % i, election=election, position=i) for i in range(options['options'])
+        ])
+        Voter.objects.bulk_create([
+            Voter(token=generate_token(election.id), email='voter%d@example.com' % i, election=election)
+            for i in range(options['voters'])
+        ], batch_size=1000)
+        return election
+
+    def admin(self, client):
+        # log in every client only once
+        if not getattr(client, 'logged_in', False):
+            client.force_login(self.user)
+            client.logged_in = True
+        return client
+
+    def run_scenarios(self, options, smtp):
+        scenarios = options['scenario'] or SCENARIOS
+        concurrency = options['concurrency']
+        self.user = User.objects.create(username='benchmark', email='benchmark@example.com')
+        election = self.seed(options, 'Benchmark')
+        url = '/api/v1/election/%d' % election.id
+        tokens = list(Voter.objects.filter(election=election).values_list('token', flat=True))
+
+        results = {
+            'date': datetime.datetime.now().isoformat(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'parameters': {key: options[key] for key in ('options', 'voters', 'concurrency', 'requests', 'batch')},
+            'config': {key: getattr(config, key)
+                       for key in ('VOTE_COUNTER_SHARDS', 'VOTE_LEDGER', 'EMAIL_CONNECTIONS')},
+            'scenarios': {},
+        }
+
+        if 'election_detail' in scenarios:
+            # election with all its voters
+            results['scenarios']['election_detail'] = measure(
+                range(options['requests']),
+                lambda client, _: self.admin(client).get(url + '?include=options,voters').status_code == 200,
+                concurrency)
+
+        if 'voter_add' in scenarios:
+            # bulk adds to a separate election, so the voters of the benchmark election stay the same
+            other = self.seed(dict(options, voters=0), 'Voter add')
+            batches = max(1, options['voters'] // options['batch'])
+            results['scenarios']['voter_add'] = measure(
+                range(batches),
+                lambda client, i: self.admin(client).post(
+                    '/api/v1/election/%d/voter' % other.id,
+                    {'voters': ['add%d-%d@example.com' % (i, j) for j in range(options['batch'])]},
+                    content_type='application/json').status_code == 200,
+                concurrency)
+            results['scenarios']['voter_add']['voters_per_request'] = options['batch']
+
+        if 'start' in scenarios or 'vote_get' in scenarios or 'vote_post' in scenarios:
+            # start queues an email for every voter, the send_emails command sends them
+            client = self.admin(Client())
+            start = time.perf_counter()
+            response = client.post(url + '/start')
+            started = time.perf_counter() - start
+            if 'start' in scenarios:
+                mail._pool = mail.ConnectionPool(config.EMAIL_CONNECTIONS, config.EMAIL_MESSAGES_PER_CONNECTION, 0)
+                start = time.perf_counter()
+                while mail.send_emails() > 0:
+                    pass
+                seconds = time.perf_counter() - start
+                results['scenarios']['start'] = {
+                    'status': response.status_code,
+                    'start_ms': round(started * 1000, 3),
+                    'emails_sent': OutboxEmail.objects.filter(status=OutboxEmail.SENT).count(),
+                    'emails_received': smtp.messages,
+                    'send_seconds': round(seconds, 4),
+                    'emails_per_second': round(smtp.messages / seconds, 2) if seconds > 0 else None,
+                }
+
+        if 'vote_get' in scenarios:
+            results['scenarios']['vote_get'] = measure(
+                (tokens[i % len(tokens)] for i in range(options['requests'] if tokens else 0)),
+                lambda client, token: client.get('/api/v1/vote/' + token).status_code == 200,
+                concurrency)
+
+        if 'vote_post' in scenarios:
+            # every voter votes once, for the first options up to votable
+            votes = list(range(election.votable))
+            results['scenarios']['vote_post'] = measure(
+                tokens,
+                lambda client, token: client.post('/api/v1/vote/' + token, {'votes': votes},
+                                                  content_type='application/json').status_code == 200,
+                concurrency)
+
+        if 'pdf_results' in scenarios:
+            client = self.admin(Client())
+            client.post(url + '/end')
+            # the first request renders and stores the report, the others get the stored report
+            start = time.perf_counter()
+            status = client.get(url + '/results').status_code
+            first = time.perf_counter() - start
+            results['scenarios']['pdf_results'] = measure(
+                range(options['requests']),
+                lambda client, _: self.admin(client).get(url + '/results').status_code == 200,
+                concurrency)
+            results['scenarios']['pdf_results']['first_status'] = status
+            results['scenarios']['pdf_results']['first_ms'] = round(first * 1000, 3)
+        return results
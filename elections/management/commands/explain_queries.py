@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from elections.models import Ballot, Election, Option, OutboxEmail, Voter, VoteCounter
+
+
+class Command(BaseCommand):
+    help = 'Shows the query plans of the main queries, to check that they use the indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--election', type=int,
+                            help='id of the election used in the queries, the newest election by default')
+        parser.add_argument('--analyze', action='store_true',
+                            help='execute the queries and show the actual costs (if supported by the database)')
+
+    def queries(self, election):
+        now = timezone.now()
+        return [
+            ('vote: voter by token', Voter.objects.filter(token='TOKEN')),
+            ('voter detail: voter by email', Voter.objects.filter(election_id=election.id, email='voter@example.com')),
+            ('voter list: page of voters', Voter.objects.filter(election_id=election.id, email__gt='a')
+                .order_by('email')[:100]),
+            ('voter list: voted filter', Voter.objects.filter(election_id=election.id, voted=False)
+                .order_by('email')[:100]),
+            ('voter list: email search', Voter.objects.filter(election_id=election.id, email__startswith='a')
+                .order_by('email')[:100]),
+            ('reminder: voters who have not voted', Voter.objects.filter(election_id=election.id, voted=False)),
+            ('election list: elections of the owner', Election.objects.filter(owner_id=election.owner_id)
+                .order_by('-creation_date')[:20]),
+            ('election detail: options', Option.objects.filter(election_id=election.id).order_by('position', 'id')),
+            ('counters: shards of the election', VoteCounter.objects.filter(election_id=election.id)),
+            ('tally: ballots not tallied yet', Ballot.objects.filter(tallied=False).order_by('id')[:1000]),
+            ('outbox: emails which are due', OutboxEmail.objects
+                .filter(status=OutboxEmail.PENDING, next_attempt__lte=now).order_by('next_attempt', 'id')[:100]),
+        ]
+
+    def handle(self, *args, **options):
+        if options['election'] is not None:
+            election = Election.objects.get(id=options['election'])
+        else:
+            # without elections the plans are shown for an election which does not exist
+            election = Election.objects.order_by('-id').first() or Election(id=0, owner_id=0)
+
+        explain_options = {'analyze': True} if options['analyze'] else {}
+        for name, queryset in self.queries(election):
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            try:
+                plan = queryset.explain(**explain_options)
+            except ValueError:
+                # the database does not support analyze (e.g. sqlite), show the plans only
+                self.stderr.write(self.style.WARNING('--analyze is not supported by %s, showing the plans only'
+                                                     % connection.vendor))
+                explain_options = {}
+                plan = queryset.explain()
+            self.stdout.write(plan)
+            self.stdout.write('')
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from elections.health import run_checks
+
+
+class Command(BaseCommand):
+    help = 'Checks database, migrations, cache and templates before the server starts'
+
+    def handle(self, *args, **options):
+        failed = 0
+        for name, error in run_checks():
+            if error is None:
+                self.stdout.write('%s: %s' % (name, self.style.SUCCESS('ok')))
+            else:
+                failed += 1
+                self.stdout.write('%s: %s' % (name, self.style.ERROR(error)))
+        # connections of the (preloading) master must not be inherited by the workers
+        connections.close_all()
+        if failed > 0:
+            raise CommandError('%d checks failed' % failed)
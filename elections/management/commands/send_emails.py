@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from elections.mail import get_pool, send_emails
+from elex import config
+
+
+class Command(BaseCommand):
+    help = 'Sends the queued emails of the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=config.EMAIL_BATCH_SIZE)
+        parser.add_argument('--loop', action='store_true',
+                            help='keep running and wait for new emails')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='seconds to wait when there are no due emails')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                processed = send_emails(batch_size=options['batch_size'])
+                if processed > 0:
+                    self.stdout.write('Processed %d emails' % processed)
+                elif not options['loop']:
+                    break
+                else:
+                    # the mail server drops idle connections, they are opened again for the next emails
+                    get_pool().close()
+                    time.sleep(options['interval'])
+        finally:
+            # close the smtp connections of the pool
+            get_pool().close()
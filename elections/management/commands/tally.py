@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from elections.votes import tally_elections
+from elex import config
+
+
+class Command(BaseCommand):
+    help = 'Counts the ballots of the ledger which are not tallied yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=config.TALLY_BATCH_SIZE)
+        parser.add_argument('--loop', action='store_true',
+                            help='keep running and wait for new ballots')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='seconds to wait when there are no new ballots')
+
+    def handle(self, *args, **options):
+        while True:
+            tallied = tally_elections(batch_size=options['batch_size'])
+            if tallied > 0:
+                self.stdout.write('Tallied %d ballots' % tallied)
+            elif not options['loop']:
+                break
+            else:
+                time.sleep(options['interval'])
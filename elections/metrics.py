@@ -0,0 +1,241 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from uuid import uuid4
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from elections.caching import cache_stats
+from elex import config
+
+# upper bounds (in seconds) of the request latency histogram
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_lock = threading.Lock()
+# per view: number of requests, latency histogram and sum, queries and sql time
+_requests = defaultdict(int)
+_buckets = defaultdict(lambda: [0] * len(BUCKETS))
+_seconds = defaultdict(float)
+_view_queries = defaultdict(int)
+_sql_seconds = defaultdict(float)
+# per section (e.g. create_report): number of calls and time spent
+_section_calls = defaultdict(int)
+_section_seconds = defaultdict(float)
+# file of this process in METRICS_DIR, a new one for every process so restarted workers keep their counts
+_file = uuid4().hex
+# thread of this process which writes its metrics to METRICS_DIR
+_flusher = None
+
+# timings and queries of the current request, also seen by the threads running its queries
+_current = contextvars.ContextVar('current', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.timings = {}
+
+    @property
+    def seconds(self):
+        return time.perf_counter() - self.start
+
+
+@contextmanager
+def timed(section):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            _section_calls[section] += 1
+            _section_seconds[section] += elapsed
+        current = _current.get()
+        if current is not None:
+            current.timings[section] = current.timings.get(section, 0) + elapsed
+
+
+def count_query(execute, sql, params, many, context):
+    current = _current.get()
+    if current is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        current.queries += 1
+        current.sql_seconds += time.perf_counter() - start
+
+
+def instrument(connection):
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    # count the queries of every new connection, also of the threads used by the async views
+    instrument(connection)
+
+
+def start_request():
+    current = RequestMetrics()
+    return current, _current.set(current)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def record_request(view, seconds, queries, sql_seconds):
+    with _lock:
+        _requests[view] += 1
+        _seconds[view] += seconds
+        _view_queries[view] += queries
+        _sql_seconds[view] += sql_seconds
+        buckets = _buckets[view]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                buckets[i] += 1
+    _start_flusher()
+
+
+def _reset():
+    global _file, _flusher
+    # a forked worker starts with its own counts and file, the ones of the parent are not counted twice
+    for counts in (_requests, _buckets, _seconds, _view_queries, _sql_seconds, _section_calls, _section_seconds):
+        counts.clear()
+    _file = uuid4().hex
+    _flusher = None
+
+
+os.register_at_fork(after_in_child=_reset)
+
+
+def _snapshot():
+    stats = cache_stats()
+    with _lock:
+        return {
+            'requests': dict(_requests), 'buckets': {view: list(counts) for view, counts in _buckets.items()},
+            'seconds': dict(_seconds), 'queries': dict(_view_queries), 'sql_seconds': dict(_sql_seconds),
+            'section_calls': dict(_section_calls), 'section_seconds': dict(_section_seconds), 'cache': stats,
+        }
+
+
+def _start_flusher():
+    global _flusher
+    # written every METRICS_FLUSH_SECONDS by a thread, so the counts of an idle worker are complete as well
+    if _flusher is not None or not settings.METRICS_DIR:
+        return
+    with _lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name='metrics', daemon=True)
+            _flusher.start()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(config.METRICS_FLUSH_SECONDS)
+        flush_metrics()
+
+
+def flush_metrics():
+    # store the metrics of this process for the other workers
+    if not settings.METRICS_DIR:
+        return
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    path = os.path.join(settings.METRICS_DIR, _file + '.json')
+    # replaced at once, so the other workers never read a partly written file
+    temporary = '%s.%d.tmp' % (path, threading.get_ident())
+    with open(temporary, 'w') as file:
+        json.dump(_snapshot(), file)
+    os.replace(temporary, path)
+
+
+def _add(total, counts):
+    for key, value in counts.items():
+        if isinstance(value, dict):
+            _add(total.setdefault(key, {}), value)
+        elif isinstance(value, list):
+            total[key] = [a + b for a, b in zip(total.get(key, [0] * len(value)), value)]
+        else:
+            total[key] = total.get(key, 0) + value
+
+
+def collect_metrics():
+    # metrics of all processes which have written to METRICS_DIR, or of this process only
+    if not settings.METRICS_DIR:
+        return _snapshot()
+    flush_metrics()
+    total = {}
+    for name in os.listdir(settings.METRICS_DIR):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(settings.METRICS_DIR, name)) as file:
+                _add(total, json.load(file))
+        except (OSError, ValueError):
+            # removed meanwhile (e.g. at a restart of the server)
+            continue
+    return total
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _metric(lines, name, kind, description, samples):
+    # samples are (suffix, labels, value), e.g. ('_bucket', (('view', 'VoteView'), ('le', 0.1)), 12)
+    lines.append('# HELP %s %s' % (name, description))
+    lines.append('# TYPE %s %s' % (name, kind))
+    for suffix, labels, value in samples:
+        labels = ','.join('%s="%s"' % (key, _label(label)) for key, label in labels)
+        lines.append('%s%s{%s} %s' % (name, suffix, labels, value))
+
+
+def render_metrics():
+    # metrics in the prometheus text format
+    metrics = collect_metrics()
+    requests, buckets, seconds = metrics.get('requests', {}), metrics.get('buckets', {}), metrics.get('seconds', {})
+    queries, sql_seconds = metrics.get('queries', {}), metrics.get('sql_seconds', {})
+    section_calls, section_seconds = metrics.get('section_calls', {}), metrics.get('section_seconds', {})
+    stats = metrics.get('cache', {})
+    lines = []
+    views = sorted(requests)
+    sections = sorted(section_calls)
+    histogram = []
+    for view in views:
+        for bound, count in zip(BUCKETS, buckets[view]):
+            histogram.append(('_bucket', (('view', view), ('le', bound)), count))
+        histogram.append(('_bucket', (('view', view), ('le', '+Inf')), requests[view]))
+        histogram.append(('_sum', (('view', view),), seconds[view]))
+        histogram.append(('_count', (('view', view),), requests[view]))
+    _metric(lines, 'elex_request_duration_seconds', 'histogram', 'Latency of the requests per view.', histogram)
+    _metric(lines, 'elex_db_queries_total', 'counter', 'SQL queries per view.',
+            [('', (('view', view),), queries[view]) for view in views])
+    _metric(lines, 'elex_db_query_seconds_total', 'counter', 'Time spent in SQL queries per view.',
+            [('', (('view', view),), sql_seconds[view]) for view in views])
+    _metric(lines, 'elex_section_calls_total', 'counter', 'Calls of timed sections like create_report.',
+            [('', (('section', section),), section_calls[section]) for section in sections])
+    _metric(lines, 'elex_section_seconds_total', 'counter', 'Time spent in timed sections.',
+            [('', (('section', section),), section_seconds[section]) for section in sections])
+    _metric(lines, 'elex_cache_hits_total', 'counter', 'Cache hits per cached value.',
+            [('', (('cache', name),), stats[name]['hits']) for name in sorted(stats)])
+    _metric(lines, 'elex_cache_misses_total', 'counter', 'Cache misses per cached value.',
+            [('', (('cache', name),), stats[name]['misses']) for name in sorted(stats)])
+    return '\n'.join(lines) + '\n'
+
+
+def server_timing(seconds, queries, sql_seconds, timings):
+    # value of the Server-Timing header, durations in milliseconds
+    metrics = ['app;dur=%.1f' % (seconds * 1000), 'db;dur=%.1f;desc="%d queries"' % (sql_seconds * 1000, queries)]
+    metrics.extend('%s;dur=%.1f' % (section, elapsed * 1000) for section, elapsed in timings.items())
+    return ', '.join(metrics)
@@ -0,0 +1,130 @@
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.db import connections
+from django.urls import Resolver404, resolve
+from django.utils.functional import SimpleLazyObject
+
+from elections import metrics
+from elections.caching import get_user
+from elections.routers import replicas, reset_replica, use_replica
+from elex import config
+
+# session key with the time until which the reads of the user go to the primary
+PIN_SESSION_KEY = 'replica_pin'
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    def process_request(self, request):
+        # logged in user from the cache instead of one query per request
+        request.user = SimpleLazyObject(lambda: get_user(request))
+
+
+class MetricsMiddleware:
+    # works in the sync and the async chain, so the async views do not need a thread per request
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not config.METRICS:
+            return self.get_response(request)
+        # connections of this thread which were opened before the middleware was loaded
+        for connection in connections.all():
+            metrics.instrument(connection)
+        current, token = metrics.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self.record(request, response, current)
+
+    async def __acall__(self, request):
+        if not config.METRICS:
+            return await self.get_response(request)
+        # queries run in other threads, they see the current request through the context
+        current, token = metrics.start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self.record(request, response, current)
+
+    def record(self, request, response, current):
+        seconds = current.seconds
+        metrics.record_request(getattr(request, 'metrics_view', 'unknown'), seconds,
+                               current.queries, current.sql_seconds)
+        if config.METRICS_SERVER_TIMING:
+            response['Server-Timing'] = metrics.server_timing(seconds, current.queries, current.sql_seconds,
+                                                              current.timings)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # name of the view class (e.g. VoteView) or function for the metrics
+        view = getattr(view_func, 'view_class', None)
+        request.metrics_view = view.__name__ if view is not None else view_func.__name__
+
+
+class ReplicaMiddleware:
+    # reads of the views with replica_reads go to a replica, except right after the user changed something
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def replica_reads(self, request):
+        if not config.REPLICA_READS or request.method not in ('GET', 'HEAD') or not replicas():
+            return False
+        try:
+            view = getattr(resolve(request.path_info).func, 'view_class', None)
+        except Resolver404:
+            return False
+        if not getattr(view, 'replica_reads', False):
+            return False
+        # read your writes, the replicas may not have the last changes of the user yet
+        # (also loads the user from the primary, before the reads are routed)
+        return not (request.user.is_authenticated and request.session.get(PIN_SESSION_KEY, 0) > time.time())
+
+    def pin(self, request, response):
+        # kept in the session, so every worker (and node) sees it and not only the one which made the change
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400 \
+                and request.user.is_authenticated:
+            request.session[PIN_SESSION_KEY] = time.time() + config.REPLICA_PIN_SECONDS
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not self.replica_reads(request):
+            response = self.get_response(request)
+            self.pin(request, response)
+            return response
+        token = use_replica()
+        try:
+            return self.get_response(request)
+        finally:
+            reset_replica(token)
+
+    async def __acall__(self, request):
+        # the user and the pin may need the database or the cache, which are synchronous
+        if not await sync_to_async(self.replica_reads)(request):
+            response = await self.get_response(request)
+            await sync_to_async(self.pin)(request, response)
+            return response
+        # the sync views run in a thread with a copy of this context
+        token = use_replica()
+        try:
+            return await self.get_response(request)
+        finally:
+            reset_replica(token)
@@ -0,0 +1,28 @@
+# Generated by Django 3.1.4 on 2026-10-17 23:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elections', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoteCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.IntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('election', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='elections.election')),
+                ('option', models.ForeignKey(default=None, null=True, on_delete=django.db.models.deletion.CASCADE, to='elections.option')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='votecounter',
+            constraint=models.UniqueConstraint(fields=('election', 'shard', 'option'), name='unique_vote_counter'),
+        ),
+    ]
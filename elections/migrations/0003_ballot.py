@@ -0,0 +1,25 @@
+# Generated by Django 3.1.4 on 2026-10-17 23:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elections', '0002_votecounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Ballot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('options', models.JSONField(default=list)),
+                ('date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('tallied', models.BooleanField(db_index=True, default=False)),
+                ('election', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='elections.election')),
+            ],
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.1.4 on 2026-10-17 23:48
+
+from django.db import migrations, models
+
+
+def number_options(apps, schema_editor):
+    Option = apps.get_model('elections', 'Option')
+    # keep the current order (by id) of the options of every election
+    positions = {}
+    for option in Option.objects.order_by('election_id', 'id'):
+        option.position = positions.get(option.election_id, 0)
+        positions[option.election_id] = option.position + 1
+        option.save(update_fields=['position'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elections', '0003_ballot'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='option',
+            options={'ordering': ['position', 'id']},
+        ),
+        migrations.AddField(
+            model_name='option',
+            name='position',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(number_options, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='option',
+            index=models.Index(fields=['election', 'position'], name='elections_o_electio_fac316_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations
+
+# same indexes as in the meta of the voter model, the table is not managed by the migrations
+INDEXES = {
+    'elections_voter_email_idx': ['election_id', 'email'],
+    'elections_voter_voted_idx': ['election_id', 'voted', 'email'],
+}
+
+
+def has_voter_table(schema_editor):
+    # skip the indexes if the table does not exist (yet)
+    return 'elections_voter' in schema_editor.connection.introspection.table_names()
+
+
+def add_indexes(apps, schema_editor):
+    if has_voter_table(schema_editor):
+        for name, columns in INDEXES.items():
+            schema_editor.execute('CREATE INDEX %s ON %s (%s)' % (
+                schema_editor.quote_name(name), schema_editor.quote_name('elections_voter'),
+                ', '.join(schema_editor.quote_name(column) for column in columns)))
+
+
+def remove_indexes(apps, schema_editor):
+    if has_voter_table(schema_editor):
+        for name in INDEXES:
+            schema_editor.execute(schema_editor.sql_delete_index % {
+                'name': schema_editor.quote_name(name), 'table': schema_editor.quote_name('elections_voter')})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elections', '0006_report'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_indexes, remove_indexes),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.4 on 2026-10-18 00:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elections', '0007_voter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='election',
+            index=models.Index(fields=['owner', 'creation_date'], name='elections_e_owner_i_d24a5f_idx'),
+        ),
+    ]
@@ -0,0 +1,98 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, F
+
+# indexes created by 0007 while the table was not managed
+OLD_INDEXES = {
+    'elections_voter_email_idx': ['election_id', 'email'],
+    'elections_voter_voted_idx': ['election_id', 'voted', 'email'],
+}
+
+
+def drop_old_indexes(schema_editor):
+    for name in OLD_INDEXES:
+        schema_editor.execute(schema_editor.sql_delete_index % {
+            'name': schema_editor.quote_name(name), 'table': schema_editor.quote_name('elections_voter')})
+
+
+def remove_duplicate_voters(apps):
+    Election = apps.get_model('elections', 'Election')
+    Voter = apps.get_model('elections', 'Voter')
+    # the unique constraint fails if an email was added twice to an election before, keep one voter
+    # per email (the one who has voted) and remove the others
+    duplicates = Voter.objects.values('election_id', 'email').annotate(count=Count('token')).filter(count__gt=1)
+    for duplicate in duplicates:
+        tokens = list(Voter.objects.filter(election_id=duplicate['election_id'], email=duplicate['email'])
+                      .order_by('-voted', 'token').values_list('token', flat=True))
+        Voter.objects.filter(token__in=tokens[1:]).delete()
+        Election.objects.filter(id=duplicate['election_id']).update(voters=F('voters') - (len(tokens) - 1))
+
+
+def create_voter_table(apps, schema_editor):
+    Voter = apps.get_model('elections', 'Voter')
+    if Voter._meta.db_table not in schema_editor.connection.introspection.table_names():
+        # new database, create the table with its indexes
+        schema_editor.create_model(Voter)
+        return
+    # existing table, replace the indexes of 0007 by the ones of the model: the unique constraint on
+    # (election, email) takes over the lookups of elections_voter_email_idx and the voted index is recreated
+    # under the same name, so both are dropped before the model indexes and the constraint are added
+    remove_duplicate_voters(apps)
+    drop_old_indexes(schema_editor)
+    for index in Voter._meta.indexes:
+        schema_editor.add_index(Voter, index)
+    for constraint in Voter._meta.constraints:
+        schema_editor.add_constraint(Voter, constraint)
+
+
+def remove_voter_indexes(apps, schema_editor):
+    Voter = apps.get_model('elections', 'Voter')
+    # keep the table and its data, only restore the indexes of 0007
+    for constraint in Voter._meta.constraints:
+        schema_editor.remove_constraint(Voter, constraint)
+    for index in Voter._meta.indexes:
+        schema_editor.remove_index(Voter, index)
+    for name, columns in OLD_INDEXES.items():
+        schema_editor.execute('CREATE INDEX %s ON %s (%s)' % (
+            schema_editor.quote_name(name), schema_editor.quote_name('elections_voter'),
+            ', '.join(schema_editor.quote_name(column) for column in columns)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elections', '0008_election_owner_index'),
+    ]
+
+    operations = [
+        # the state of the unmanaged model did not match the table, replace it by the actual schema
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.DeleteModel(
+                    name='Voter',
+                ),
+                migrations.CreateModel(
+                    name='Voter',
+                    fields=[
+                        ('token', models.CharField(max_length=255, primary_key=True, serialize=False, unique=True)),
+                        ('email', models.EmailField(max_length=255)),
+                        ('voted', models.BooleanField(default=False)),
+                        ('election', models.ForeignKey(
+                            on_delete=django.db.models.deletion.CASCADE, to='elections.election')),
+                    ],
+                    options={
+                        'db_table': 'elections_voter',
+                    },
+                ),
+                migrations.AddIndex(
+                    model_name='voter',
+                    index=models.Index(fields=['election', 'voted', 'email'], name='elections_voter_voted_idx'),
+                ),
+                migrations.AddConstraint(
+                    model_name='voter',
+                    constraint=models.UniqueConstraint(fields=['election', 'email'], name='unique_voter'),
+                ),
+            ],
+        ),
+        migrations.RunPython(create_voter_table, remove_voter_indexes),
+    ]
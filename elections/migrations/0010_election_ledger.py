@@ -0,0 +1,26 @@
+# Generated by Django 3.1.4 on 2026-10-18 00:37
+
+from django.db import migrations, models
+
+
+def mark_ledger_elections(apps, schema_editor):
+    Ballot = apps.get_model('elections', 'Ballot')
+    Election = apps.get_model('elections', 'Election')
+    # running elections which already have ballots were started with the ledger
+    Election.objects.filter(end_date__isnull=True, id__in=Ballot.objects.values('election_id')).update(ledger=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elections', '0009_managed_voter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='election',
+            name='ledger',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_ledger_elections, migrations.RunPython.noop),
+    ]
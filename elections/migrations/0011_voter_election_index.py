@@ -0,0 +1,21 @@
+# Generated by Django 3.1.4 on 2026-10-18 00:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elections', '0010_election_ledger'),
+    ]
+
+    operations = [
+        # the unique constraint on (election, email) already covers lookups by election
+        migrations.AlterField(
+            model_name='voter',
+            name='election',
+            field=models.ForeignKey(
+                db_index=False, on_delete=django.db.models.deletion.CASCADE, to='elections.election'),
+        ),
+    ]
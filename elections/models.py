@@ -16,6 +16,14 @@ class Election(models.Model):
     creation_date = models.DateTimeField(default=timezone.now)
     start_date = models.DateTimeField(null=True, default=None)
     end_date = models.DateTimeField(null=True, default=None)
+    # votes are appended to the ballot ledger, VOTE_LEDGER when the election was started
+    ledger = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # elections of an owner are listed newest first
+            models.Index(fields=['owner', 'creation_date']),
+        ]
 
 
 class Option(models.Model):
@@ -24,8 +32,14 @@ class Option(models.Model):
         Election, on_delete=models.CASCADE
     )
     votes = models.IntegerField(default=0)
+    # stable order of the options within the election
+    position = models.IntegerField(default=0)
 
     class Meta:
+        ordering = ['position', 'id']
+        indexes = [
+            models.Index(fields=['election', 'position'])
+        ]
         constraints = [
             models.UniqueConstraint(fields=['name', 'election'],
                                     name='unique_option')
@@ -35,11 +49,87 @@ class Option(models.Model):
 class Voter(models.Model):
     token = models.CharField(unique=True, max_length=255, primary_key=True)
     email = models.EmailField(max_length=255)
+    # no index of its own, election is the leading column of the unique constraint
     election = models.ForeignKey(
-        Election, on_delete=models.CASCADE
+        Election, on_delete=models.CASCADE, db_index=False
     )
     voted = models.BooleanField(default=False)
 
     class Meta:
-        managed = False
         db_table = 'elections_voter'
+        indexes = [
+            # voter list is paginated by email and filtered by voted, reminders are sent to who has not voted
+            models.Index(fields=['election', 'voted', 'email'], name='elections_voter_voted_idx'),
+        ]
+        constraints = [
+            # every email only once per election, also used to look up a voter by email
+            models.UniqueConstraint(fields=['election', 'email'], name='unique_voter'),
+        ]
+
+
+class VoteCounter(models.Model):
+    election = models.ForeignKey(
+        Election, on_delete=models.CASCADE
+    )
+    # counter for the votes of an option or, without option, for the voted count of the election
+    option = models.ForeignKey(
+        Option, on_delete=models.CASCADE, null=True, default=None
+    )
+    shard = models.IntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['election', 'shard', 'option'],
+                                    name='unique_vote_counter')
+        ]
+
+
+class Ballot(models.Model):
+    election = models.ForeignKey(
+        Election, on_delete=models.CASCADE
+    )
+    # ids of the voted options, the ballot is not linked to the voter
+    options = models.JSONField(default=list)
+    date = models.DateTimeField(default=timezone.now)
+    tallied = models.BooleanField(default=False, db_index=True)
+
+
+class OutboxEmail(models.Model):
+    PENDING = 0
+    SENT = 1
+    FAILED = 2
+
+    election = models.ForeignKey(
+        Election, on_delete=models.CASCADE
+    )
+    email = models.EmailField(max_length=255)
+    token = models.CharField(max_length=255)
+    reminder = models.BooleanField(default=False)
+    status = models.IntegerField(default=PENDING)
+    attempts = models.IntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    error = models.CharField(max_length=500, blank=True, default='')
+    creation_date = models.DateTimeField(default=timezone.now)
+    sent_date = models.DateTimeField(null=True, default=None)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt'])
+        ]
+
+
+class Report(models.Model):
+    election = models.ForeignKey(
+        Election, on_delete=models.CASCADE
+    )
+    # hash of the report template the pdf was rendered with
+    version = models.CharField(max_length=64)
+    pdf = models.BinaryField()
+    creation_date = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['election', 'version'],
+                                    name='unique_report')
+        ]
@@ -0,0 +1,7 @@
+# runs in the processes of the report pool, so it must not depend on django
+
+
+def render_pdf(html):
+    # weasyprint is only loaded by the report processes
+    from weasyprint import HTML
+    return HTML(string=html).write_pdf()
@@ -0,0 +1,211 @@
+import csv
+import datetime
+import functools
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import jinja2
+import pytz
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from elections.metrics import timed
+from elections.models import Election, Option, Report
+from elections.routers import primary
+from elections.pdf import render_pdf
+from elections.votes import count_voted, count_votes
+from elex import config
+
+TEMPLATE_DIR = "./elections/templates/"
+
+
+class ReportUnavailable(Exception):
+    pass
+
+
+_executor = None
+# maximum number of reports rendered or waiting at the same time
+_jobs = threading.BoundedSemaphore(config.REPORT_MAX_JOBS)
+_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            # spawned processes do not inherit the threads and connections of the web worker
+            _executor = ProcessPoolExecutor(max_workers=config.REPORT_WORKERS,
+                                            mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+
+def reset_executor(executor):
+    global _executor
+    # a pool with a crashed process (e.g. killed for its memory) takes no more jobs, start a new one
+    with _lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False)
+
+
+def render_report(html):
+    if not _jobs.acquire(blocking=False):
+        raise ReportUnavailable('Too many reports are rendered at the moment')
+    executor = get_executor()
+    try:
+        # render the pdf in the process pool, so the request thread only waits
+        future = executor.submit(render_pdf, html)
+    except BrokenProcessPool:
+        _jobs.release()
+        reset_executor(executor)
+        raise ReportUnavailable('The report process has crashed')
+    # the job is counted until it has finished, also when the request does not wait for it anymore
+    future.add_done_callback(lambda future: _jobs.release())
+    try:
+        return future.result(timeout=config.REPORT_TIMEOUT)
+    except TimeoutError:
+        # drop the job if it has not started yet
+        future.cancel()
+        raise ReportUnavailable('Rendering the report timed out')
+    except BrokenProcessPool:
+        reset_executor(executor)
+        raise ReportUnavailable('The report process has crashed')
+
+
+@functools.lru_cache(maxsize=None)
+def get_environment():
+    # compiled templates are cached by the environment and reloaded when they change
+    return jinja2.Environment(loader=jinja2.FileSystemLoader(searchpath=TEMPLATE_DIR))
+
+
+@timed('create_report')
+def create_report(results, election):
+    # get options (names) and votes (number of votes)
+    options = results.keys()
+    votes = results.values()
+
+    today = datetime.datetime.today()
+    # save information in meta dict
+    meta = {
+        "election": {
+            "name": election.name,
+            "description": election.description,
+            "voters": election.voters,
+            "votes": sum(votes),
+            "voted": count_voted(election),
+            "votable": election.votable,
+            "start": election.start_date.replace(tzinfo=pytz.UTC)
+                .astimezone(timezone.get_current_timezone()).strftime("%d/%m/%Y, %H:%M Uhr"),
+            "end": election.end_date.replace(tzinfo=pytz.UTC)
+                .astimezone(timezone.get_current_timezone()).strftime("%d/%m/%Y, %H:%M Uhr"),        },
+        "year": today.strftime("%Y"),
+        "date": today.strftime("%d/%m/%Y, %H:%M Uhr")
+    }
+
+    # convert results data to a list of rows (table)
+    results = [{"name": option, "votes": count} for option, count in zip(options, votes)]
+    # get template and fill in the data (render)
+    template = get_environment().get_template(config.REPORT_TEMPLATE)
+    html = template.render(results=results, meta=meta)
+
+    # return the rendered pdf
+    return render_report(html)
+
+
+def template_version():
+    # reports have to be rendered again when the template changes
+    return _template_version(config.REPORT_TEMPLATE)
+
+
+@functools.lru_cache(maxsize=None)
+def _template_version(name):
+    # templates change only with a deployment, so the file is hashed once per process
+    with open(os.path.join(TEMPLATE_DIR, name), 'rb') as template:
+        return hashlib.sha1(name.encode() + template.read()).hexdigest()
+
+
+def get_report(election):
+    version = template_version()
+    # the pdf itself is only loaded when it is needed
+    report = Report.objects.defer('pdf').filter(election_id=election.id, version=version).first()
+    if report is not None:
+        return report
+
+    # the report is stored, so render it with the final results of the primary and not of a replica
+    with primary():
+        election = Election.objects.get(id=election.id)
+        results = {}
+        for option in count_votes(election).order_by('-total', 'name').values('name', 'total'):
+            results[option.get('name')] = option.get('total')
+        pdf = create_report(results, election)
+        try:
+            with transaction.atomic():
+                return Report.objects.create(election_id=election.id, version=version, pdf=pdf)
+        except IntegrityError:
+            # report was stored by a concurrent request in the meantime, load it with the pdf
+            # (it may not be on the replicas yet)
+            return Report.objects.get(election_id=election.id, version=version)
+
+
+def export_results(elections):
+    # options of all elections with one query, grouped by election
+    options = Option.objects.filter(election__in=elections).order_by('election_id', '-votes', 'name')\
+        .values_list('election_id', 'name', 'votes').iterator()
+    groups = itertools.groupby(options, key=lambda option: option[0])
+    group = next(groups, None)
+
+    for election in elections.order_by('id').iterator():
+        rows = []
+        # skip options of elections which are not exported
+        while group is not None and group[0] <= election.id:
+            if group[0] == election.id:
+                rows = [(name, votes) for _, name, votes in group[1]]
+            group = next(groups, None)
+
+        votes = sum(count for _, count in rows)
+        yield {
+            "id": election.id,
+            "name": election.name,
+            "voters": election.voters,
+            "voted": election.voted,
+            "turnout": round(election.voted / election.voters, 4) if election.voters > 0 else 0,
+            "start_date": election.start_date.isoformat(),
+            "end_date": election.end_date.isoformat(),
+            "results": [
+                {"option": name, "votes": count, "share": round(count / votes, 4) if votes > 0 else 0}
+                for name, count in rows
+            ]
+        }
+
+
+class Echo:
+    # file like object returning the written value, used to stream csv lines
+    def write(self, value):
+        return value
+
+
+def results_csv(elections):
+    writer = csv.writer(Echo())
+    yield writer.writerow(['election_id', 'election', 'option', 'votes', 'share', 'voters', 'voted', 'turnout'])
+    for election in export_results(elections):
+        for result in election["results"]:
+            yield writer.writerow([election["id"], election["name"], result["option"], result["votes"],
+                                   result["share"], election["voters"], election["voted"], election["turnout"]])
+
+
+def results_json(elections, many=True):
+    if not many:
+        # a single election as object instead of a list
+        for election in export_results(elections):
+            yield json.dumps(election)
+        return
+    yield '['
+    for i, election in enumerate(export_results(elections)):
+        yield (',' if i > 0 else '') + json.dumps(election)
+    yield ']'
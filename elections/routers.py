@@ -0,0 +1,49 @@
+import contextvars
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# reads of the current request may be served by a replica
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+
+
+def replicas():
+    return [alias for alias in settings.DATABASES if alias != DEFAULT_DB_ALIAS]
+
+
+def use_replica():
+    return _replica_reads.set(True)
+
+
+def reset_replica(token):
+    _replica_reads.reset(token)
+
+
+@contextmanager
+def primary():
+    # read from the primary within the block, e.g. before storing something derived from the reads
+    token = _replica_reads.set(False)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class ReplicaRouter:
+    # writes always go to the primary, reads only to a replica when the view allows it (replica_reads)
+
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get():
+            aliases = replicas()
+            if aliases:
+                return random.choice(aliases)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas have the same data as the primary
+        return True
@@ -1,9 +1,18 @@
 from uuid import uuid4
 
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
 from elections.models import Election, Voter, Option
+from elections.votes import count_voted, count_votes
+from elex import config
+
+
+def generate_token(election_id):
+    token = str(uuid4())
+    return (token[:10] + hex(election_id)[2:] + token[10:]).upper()
 
 
 class ElectionSerializer(serializers.Serializer):
@@ -60,35 +69,39 @@ class ElectionSerializer(serializers.Serializer):
 
 
 class ElectionDetailSerializer(ElectionSerializer):
+    # sections of the detailed information, voters only on request (use the paginated voter list instead)
+    sections = ('options', 'voters', 'results')
+    default_sections = ('options', 'results')
+
+    def get_sections(self):
+        include = self.context.get('include')
+        if not include:
+            return self.default_sections
+        return [section for section in include.split(',') if section in self.sections]
 
     def to_representation(self, instance):
         # call standard election to representation function
         ret = ElectionSerializer.to_representation(self, instance)
+        sections = self.get_sections()
         # add more detailed information
         ret["votable"] = instance.votable
-        ret["options"] = []
-        if instance.end_date is None:
-            ret["voters"] = []
-        else:
-            ret["voters"] = instance.voters
-
-        # if election is closed return also results
-        if instance.end_date is not None:
-            ret["results"] = {}
-
-        # add all options and voters of this election
-        for option in Option.objects.filter(election_id=instance.id).values():
-            ret["options"].append(option.get('name'))
-            if instance.end_date is not None:
-                ret["results"][option.get('name')] = option.get('votes')
-
-        if instance.end_date is not None:
-            # sort first by option name and then by votes
-            ret["results"] = dict(sorted(ret["results"].items(), key=lambda item: item[0]))
-            ret["results"] = dict(sorted(ret["results"].items(), key=lambda item: item[1], reverse=True))
-
-        for voter in Voter.objects.filter(election_id=instance.id).values():
-            ret["voters"].append(voter.get('email'))
+        ret["voted"] = count_voted(instance)
+
+        if 'options' in sections:
+            ret["options"] = []
+            ret["option_ids"] = []
+            for option_id, name in Option.objects.filter(election_id=instance.id)\
+                    .order_by('position', 'id').values_list('id', 'name'):
+                ret["options"].append(name)
+                ret["option_ids"].append(option_id)
+
+        # if election is closed return also results, sorted first by votes and then by option name
+        if 'results' in sections and instance.end_date is not None:
+            ret["results"] = dict(count_votes(instance).order_by('-total', 'name').values_list('name', 'total'))
+
+        # voters are only listed until the election has ended, afterwards only their number is returned
+        if 'voters' in sections and instance.end_date is None:
+            ret["voters"] = list(Voter.objects.filter(election_id=instance.id).values_list('email', flat=True))
         return ret
 
 
@@ -105,16 +118,21 @@ class OptionDetailSerializer(serializers.Serializer):
         name = validated_data.get('name')
         election_id = validated_data.get('election_id')
 
-        if Option.objects.filter(election_id=election_id, name=name).exists():
-            # option for this election already existing
+        # append option after the existing options of this election
+        position = Option.objects.filter(election_id=election_id).aggregate(Max('position'))
+        position = position.get('position__max')
+
+        try:
+            # save option object, the unique constraint rejects an option already existing for this election
+            with transaction.atomic():
+                return Option.objects.create(
+                    name=name,
+                    election_id=election_id,
+                    position=0 if position is None else position + 1
+                )
+        except IntegrityError:
             raise ValidationError()
 
-        # save option object
-        return Option.objects.create(
-            name=name,
-            election_id=election_id
-        )
-
 
 class VoterSerializer(serializers.Serializer):
     voters = serializers.ListField(
@@ -122,52 +140,143 @@ class VoterSerializer(serializers.Serializer):
     )
 
 
-class VoterDetailSerializer(serializers.Serializer):
-    email = serializers.EmailField(max_length=255)
-
-    def __generate_token(self, election_id):
-        token = str(uuid4())
-        return (token[:10] + hex(election_id)[2:] + token[10:]).upper()
-
-    def create(self, validated_data):
-        email = validated_data.get('email')
-        election_id = validated_data.get('election_id')
+class VoterQuerySerializer(serializers.Serializer):
+    # voters are ordered by email, a page starts after the last email of the previous page
+    after = serializers.CharField(max_length=255, required=False)
+    search = serializers.CharField(max_length=255, required=False)
+    voted = serializers.BooleanField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=config.VOTER_PAGE_MAX, required=False)
+
+    def get_page(self, election):
+        voters = Voter.objects.filter(election_id=election.id)
+        if 'voted' in self.validated_data:
+            voters = voters.filter(voted=self.validated_data.get('voted'))
+        if 'search' in self.validated_data:
+            voters = voters.filter(email__startswith=self.validated_data.get('search'))
+        if 'after' in self.validated_data:
+            voters = voters.filter(email__gt=self.validated_data.get('after'))
+        limit = self.validated_data.get('limit', config.VOTER_PAGE_SIZE)
+        # fetch one more voter to know if there is a next page
+        page = list(voters.order_by('email').values_list('email', 'voted')[:limit + 1])
+        return {
+            "voters": [{"email": email, "voted": voted} for email, voted in page[:limit]],
+            "next": page[limit - 1][0] if len(page) > limit else None
+        }
 
-        if Voter.objects.filter(election_id=election_id, email=email).exists():
-            # voter for this election already existing
-            raise ValidationError()
 
-        # generate token
-        token = self.__generate_token(election_id)
-        while Voter.objects.filter(token=token).exists():
-            # repeat while duplicate exists
-            token = self.__generate_token(election_id)
+class VoterImportSerializer(VoterSerializer):
+    # number of emails checked and voters inserted with one query
+    batch_size = config.VOTER_IMPORT_BATCH_SIZE
+
+    def __check_emails(self, emails):
+        field = serializers.EmailField(max_length=255)
+        checked = {}
+        for email in emails:
+            try:
+                # check if email is valid
+                email = field.run_validation(email)
+            except ValidationError:
+                self.report['rejected'][email] = 'invalid'
+                continue
+            if email.lower() in checked:
+                # email more than once in the list
+                self.report['rejected'][email] = 'duplicate'
+                continue
+            checked[email.lower()] = email
+        return checked
+
+    def __generate_tokens(self, election_id, count):
+        tokens = set()
+        while len(tokens) < count:
+            new_tokens = set(generate_token(election_id) for _ in range(count - len(tokens)))
+            # drop the (very unlikely) tokens which already exist
+            new_tokens.difference_update(Voter.objects.filter(token__in=new_tokens).values_list('token', flat=True))
+            tokens.update(new_tokens)
+        return list(tokens)
 
-        return Voter.objects.create(
-            token=token,
-            email=email,
-            election_id=election_id
-        )
+    def create(self, validated_data):
+        election = validated_data.get('election')
+        self.report = {'accepted': [], 'rejected': {}}
+        emails = self.__check_emails(validated_data.get('voters'))
+
+        # remove emails already existing for this election
+        checked = list(emails.values())
+        for i in range(0, len(checked), self.batch_size):
+            for email in Voter.objects.filter(election_id=election.id, email__in=checked[i:i + self.batch_size])\
+                    .values_list('email', flat=True):
+                # the collation of the database may match another spelling (e.g. accents), which is then
+                # rejected by the unique constraint when it is inserted
+                if email.lower() in emails:
+                    self.report['rejected'][emails.pop(email.lower())] = 'existing'
+
+        voters = []
+        checked = list(emails.values())
+        for i in range(0, len(checked), self.batch_size):
+            batch = checked[i:i + self.batch_size]
+            for email, token in zip(batch, self.__generate_tokens(election.id, len(batch))):
+                voters.append(Voter(token=token, email=email, election_id=election.id))
+
+        with transaction.atomic():
+            inserted = []
+            while voters:
+                # a concurrent import may have added the same email (or token) meanwhile, those rows are skipped
+                Voter.objects.bulk_create(voters, batch_size=self.batch_size, ignore_conflicts=True)
+                saved = {}
+                for i in range(0, len(voters), self.batch_size):
+                    tokens = [voter.token for voter in voters[i:i + self.batch_size]]
+                    saved.update(Voter.objects.filter(token__in=tokens).values_list('token', 'email'))
+                skipped = []
+                for voter in voters:
+                    if saved.get(voter.token) == voter.email:
+                        inserted.append(voter)
+                    elif Voter.objects.filter(election_id=election.id, email=voter.email).exists():
+                        self.report['rejected'][voter.email] = 'existing'
+                    else:
+                        # only the token was taken, try again with a new one
+                        voter.token = self.__generate_tokens(election.id, 1)[0]
+                        skipped.append(voter)
+                voters = skipped
+            # update the number of voters once
+            Election.objects.filter(id=election.id).update(voters=F('voters') + len(inserted))
+        election.voters = election.voters + len(inserted)
+        self.report['accepted'] = [voter.email for voter in inserted]
+        return inserted
 
 
 class VoteSerializer(serializers.Serializer):
+    # voted options either by their index or by their id
     votes = serializers.ListField(
-        child=serializers.IntegerField(min_value=0)
+        child=serializers.IntegerField(min_value=0), required=False
+    )
+    options = serializers.ListField(
+        child=serializers.IntegerField(min_value=0), required=False
     )
 
     def __init__(self, *args, **kwargs):
+        # ids of all available options, ordered by their position
         self.options = kwargs.pop('options')
         self.votable = kwargs.pop('votable')
         super().__init__(*args, **kwargs)
 
     def validate(self, attrs):
-        # remove duplicates
-        attrs['votes'] = list(set(attrs.get('votes')))
+        if 'options' not in attrs and 'votes' not in attrs:
+            raise ValidationError('No votes')
+        if 'options' in attrs:
+            # remove duplicates
+            option_ids = set(attrs.get('options'))
+            # check if every option is one of the available options
+            if not option_ids.issubset(self.options):
+                raise ValidationError('Out of range')
+        else:
+            # remove duplicates
+            votes = set(attrs.get('votes'))
+            # check if every option is in the range of the available options
+            for vote in votes:
+                if vote >= len(self.options):
+                    raise ValidationError('Out of range')
+            option_ids = set(self.options[vote] for vote in votes)
         # check if there are too many voted options
-        if len(attrs.get('votes')) > self.votable:
+        if len(option_ids) > self.votable:
             raise ValidationError('Too many options')
-        # check if every option is in the range of the available options
-        for vote in attrs.get('votes'):
-            if vote >= self.options:
-                raise ValidationError('Out of range')
+        attrs['options'] = list(option_ids)
         return attrs
\ No newline at end of file
@@ -1,3 +1,888 @@
-from django.test import TestCase
+import io
+import json
+import os
+import re
+import tempfile
+from smtplib import SMTPException, SMTPServerDisconnected
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.template import engines
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from openpyxl import Workbook
+
+from elections import health, reports
+from elections.caching import get_user, user_key
+from elections.mail import ConnectionPool, EmailTemplate, RateLimiter, claim_emails, send_emails
+from elections.metrics import BUCKETS
+from elections.models import Ballot, Election, Option, OutboxEmail, Report, Voter, VoteCounter
+from elections.reports import ReportUnavailable, render_report
+from elections.views import vote_async
+from elex import config
+
+
+class ElectionSetup:
+
+    def setUp(self):
+        cache.clear()
+        # the test databases of the replicas are empty, read everything from the primary
+        patcher = mock.patch.object(config, 'REPLICA_READS', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create(username='owner', email='owner@example.com')
+        self.client.force_login(self.user)
+        self.election = Election.objects.create(name='Election', owner=self.user, votable=2, voters=3)
+        self.options = [Option.objects.create(name=name, election=self.election, position=position)
+                        for position, name in enumerate(['A', 'B', 'C'])]
+        for i in range(3):
+            Voter.objects.create(token='TOKEN%d' % i, email='voter%d@example.com' % i, election=self.election)
+
+    def start(self):
+        self.election.start_date = timezone.now()
+        self.election.save()
+
+    def end(self):
+        self.election.start_date = timezone.now()
+        self.election.end_date = timezone.now()
+        self.election.save()
+
+    def url(self, path=''):
+        return '/api/v1/election/%d%s' % (self.election.id, path)
+
+
+class ElectionTestCase(ElectionSetup, TestCase):
+    pass
+
+
+class QueryBudgetTest(ElectionTestCase):
+    # number of queries every endpoint may use, independent of the number of options and voters
+
+    def test_election_list(self):
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/v1/election')
+        self.assertEqual(response.status_code, 200)
+
+    def test_election_detail(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['options'], ['A', 'B', 'C'])
+        self.assertEqual(response.data['voters'], 3)
+
+    def test_election_detail_voters(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url() + '?include=voters')
+        self.assertEqual(sorted(response.data['voters']), ['voter%d@example.com' % i for i in range(3)])
+        self.assertNotIn('options', response.data)
+
+    def test_election_detail_results(self):
+        Option.objects.filter(id=self.options[2].id).update(votes=2)
+        Option.objects.filter(id=self.options[1].id).update(votes=1)
+        self.end()
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url() + '?include=results')
+        self.assertEqual(list(response.data['results'].items()), [('C', 2), ('B', 1), ('A', 0)])
+        self.assertNotIn('options', response.data)
+
+    def test_election_patch(self):
+        with self.assertNumQueries(4):
+            response = self.client.patch(self.url(), {'name': 'Renamed'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_start(self):
+        with self.assertNumQueries(6):
+            response = self.client.post(self.url('/start'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_pause(self):
+        self.start()
+        with self.assertNumQueries(3):
+            response = self.client.post(self.url('/pause'))
+        self.assertEqual(response.status_code, 204)
+
+    def test_end(self):
+        self.start()
+        with self.assertNumQueries(12):
+            response = self.client.post(self.url('/end'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_remind(self):
+        self.start()
+        with self.assertNumQueries(4):
+            response = self.client.post(self.url('/remind'))
+        self.assertEqual(response.status_code, 204)
+
+    def test_option_add(self):
+        with self.assertNumQueries(7):
+            response = self.client.post(self.url('/option'), {'options': ['D']}, content_type='application/json')
+        self.assertEqual(response.data['options'], ['A', 'B', 'C', 'D'])
+
+    def test_option_delete(self):
+        with self.assertNumQueries(6):
+            response = self.client.delete(self.url('/option/id/%d' % self.options[1].id))
+        self.assertEqual(response.data['options'], ['A', 'C'])
+
+    def test_voter_add(self):
+        # the inserted voters are read again, another import may have added the same emails
+        with self.assertNumQueries(9):
+            response = self.client.post(self.url('/voter'), {'voters': ['new%d@example.com' % i for i in range(10)]},
+                                        content_type='application/json')
+        self.assertEqual(response.data, {'added': 10, 'rejected': 0, 'voters': 13})
+
+    def test_voter_list(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url('/voter'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_voter_delete(self):
+        with self.assertNumQueries(5):
+            response = self.client.delete(self.url('/voter/voter0@example.com'))
+        self.assertEqual(response.data, {'removed': 1, 'voters': 2})
+
+    def test_vote_get(self):
+        self.start()
+        # voters are not logged in
+        self.client.logout()
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/v1/vote/TOKEN0')
+        self.assertEqual(response.data['owner'], 'owner@example.com')
+        # ballot of the election is cached, only the voter is fetched
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/vote/TOKEN1')
+        self.assertEqual(response.data['options'], ['A', 'B', 'C'])
+
+    def test_vote_post(self):
+        self.start()
+        self.client.logout()
+        # load the ballot page first, so the ballot is cached
+        self.client.get('/api/v1/vote/TOKEN0')
+        with self.assertNumQueries(6):
+            response = self.client.post('/api/v1/vote/TOKEN0', {'votes': [0, 2]}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([option.votes for option in Option.objects.filter(election=self.election)], [1, 0, 1])
+
+    def test_results_export(self):
+        self.end()
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url('/results/csv'))
+            content = b''.join(response.streaming_content)
+        self.assertEqual(len(content.splitlines()), 4)
+
+
+class VoteTest(ElectionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.start()
+        self.client.logout()
+        # ballot of the election is cached by the ballot page
+        self.client.get('/api/v1/vote/TOKEN0')
+
+    def vote(self, token, votes):
+        return self.client.post('/api/v1/vote/' + token, {'votes': votes}, content_type='application/json')
+
+    def results(self):
+        self.election.refresh_from_db()
+        return self.election.voted, [option.votes for option in Option.objects.filter(election=self.election)]
+
+    def test_double_vote(self):
+        self.assertEqual(self.vote('TOKEN0', [0, 2]).status_code, 200)
+        self.assertEqual(self.vote('TOKEN0', [1]).status_code, 403)
+        self.assertEqual(self.results(), (1, [1, 0, 1]))
+
+    def test_paused(self):
+        # paused after the ballot was cached, the vote is rolled back
+        Election.objects.filter(id=self.election.id).update(paused=1)
+        self.assertEqual(self.vote('TOKEN0', [0]).status_code, 403)
+        self.assertEqual(self.results(), (0, [0, 0, 0]))
+        self.assertFalse(Voter.objects.get(token='TOKEN0').voted)
+
+    def test_ended(self):
+        Election.objects.filter(id=self.election.id).update(end_date=timezone.now())
+        self.assertEqual(self.vote('TOKEN0', [0]).status_code, 403)
+        self.assertEqual(self.results(), (0, [0, 0, 0]))
+        self.assertFalse(Voter.objects.get(token='TOKEN0').voted)
+
+
+class ShardTest(ElectionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(config, 'VOTE_COUNTER_SHARDS', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_shards(self):
+        self.client.post(self.url('/start'))
+        # two shards for the voted count and for every option
+        self.assertEqual(VoteCounter.objects.filter(election=self.election).count(), 8)
+        for token, votes in (('TOKEN0', [0, 2]), ('TOKEN1', [2])):
+            response = self.client.post('/api/v1/vote/' + token, {'votes': votes}, content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+        # the votes are only counted by the shards
+        self.assertEqual([option.votes for option in Option.objects.filter(election=self.election)], [0, 0, 0])
+        # running election with shards: election, options and the sum of the shards
+        with self.assertNumQueries(3):
+            self.assertEqual(self.client.get(self.url()).data['voted'], 2)
+
+        # and merged into the results when the election ends
+        self.client.post(self.url('/end'))
+        self.assertFalse(VoteCounter.objects.filter(election=self.election).exists())
+        self.assertEqual([option.votes for option in Option.objects.filter(election=self.election)], [1, 0, 2])
+        response = self.client.get(self.url())
+        self.assertEqual(response.data['voted'], 2)
+        self.assertEqual(response.data['results'], {'C': 2, 'A': 1, 'B': 0})
+
+
+class LedgerTest(ElectionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        with mock.patch.object(config, 'VOTE_LEDGER', True):
+            self.client.post(self.url('/start'))
+
+    def vote(self, token, votes):
+        response = self.client.post('/api/v1/vote/' + token, {'votes': votes}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+    def votes(self):
+        return [option.votes for option in Option.objects.filter(election=self.election)]
+
+    def test_tally(self):
+        self.vote('TOKEN0', [0, 2])
+        self.vote('TOKEN1', [2])
+        # ballots are only appended to the ledger
+        self.assertEqual(Ballot.objects.filter(election=self.election, tallied=False).count(), 2)
+        self.assertEqual(self.votes(), [0, 0, 0])
+        # and counted by the tally command
+        call_command('tally', stdout=io.StringIO())
+        self.assertFalse(Ballot.objects.filter(tallied=False).exists())
+        self.assertEqual(self.votes(), [1, 0, 2])
+        self.assertEqual(Election.objects.get(id=self.election.id).voted, 2)
+
+    def test_end(self):
+        self.vote('TOKEN0', [0, 2])
+        # remaining ballots are counted when the election ends
+        self.assertEqual(self.client.post(self.url('/end')).status_code, 200)
+        self.assertEqual(self.client.get(self.url()).data['results'], {'A': 1, 'C': 1, 'B': 0})
+        self.assertFalse(Voter.objects.filter(election=self.election).exists())
+
+    def test_mode(self):
+        # the election keeps counting with the ledger, even if the setting changes
+        with mock.patch.object(config, 'VOTE_LEDGER', False):
+            self.vote('TOKEN0', [0])
+        self.assertEqual(Ballot.objects.filter(election=self.election).count(), 1)
+        self.assertEqual(self.votes(), [0, 0, 0])
+        self.assertEqual(self.client.post(self.url('/end')).status_code, 200)
+
+    def test_mismatch(self):
+        self.vote('TOKEN0', [0])
+        self.vote('TOKEN1', [0, 1])
+        # results changed outside of the ledger
+        Option.objects.filter(id=self.options[2].id).update(votes=1)
+        self.assertEqual(self.client.post(self.url('/end')).status_code, 409)
+        # the election stays open and the results are not published
+        response = self.client.get(self.url())
+        self.assertIsNone(response.data['end_date'])
+        self.assertNotIn('results', response.data)
+        self.assertEqual(Voter.objects.filter(election=self.election).count(), 3)
+        self.assertEqual(Ballot.objects.filter(election=self.election, tallied=False).count(), 2)
+
+    def test_ended(self):
+        # the vote was checked against a cached ballot, the election ended in the meantime
+        self.client.get('/api/v1/vote/TOKEN0')
+        Election.objects.filter(id=self.election.id).update(end_date=timezone.now())
+        response = self.client.post('/api/v1/vote/TOKEN0', {'votes': [0]}, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Ballot.objects.exists())
+
+
+class VoterImportTest(ElectionTestCase):
+
+    def test_report(self):
+        voters = ['voter0@example.com', 'New@example.com', 'new@example.com', 'invalid', 'other@example.com']
+        response = self.client.post(self.url('/voter/import'), {'voters': voters}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(response.data['accepted']), ['New@example.com', 'other@example.com'])
+        self.assertEqual(response.data['rejected'], {
+            'voter0@example.com': 'existing', 'new@example.com': 'duplicate', 'invalid': 'invalid'})
+        self.assertEqual(response.data['voters'], 5)
+        self.assertEqual(Voter.objects.filter(election=self.election).count(), 5)
+
+    def test_concurrent(self):
+        bulk_create = Voter.objects.bulk_create
+
+        def concurrent_import(voters, **kwargs):
+            if not Voter.objects.filter(token='OTHER0').exists():
+                # another import adds the same email and takes a token in the meantime
+                Voter.objects.create(token='OTHER0', email='new0@example.com', election=self.election)
+                Voter.objects.create(token=voters[1].token, email='other@example.com', election=self.election)
+            return bulk_create(voters, **kwargs)
+
+        with mock.patch.object(Voter.objects, 'bulk_create', side_effect=concurrent_import):
+            response = self.client.post(self.url('/voter/import'), {'voters': ['new0@example.com', 'new1@example.com']},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['accepted'], ['new1@example.com'])
+        self.assertEqual(response.data['rejected'], {'new0@example.com': 'existing'})
+        self.assertTrue(Voter.objects.filter(election=self.election, email='new1@example.com').exists())
+
+    def test_get(self):
+        # the import endpoints do not list the voters
+        self.assertEqual(self.client.get(self.url('/voter/import')).status_code, 405)
+        self.assertEqual(self.client.get(self.url('/voter/upload')).status_code, 405)
+
+
+class VoterUploadTest(ElectionTestCase):
+
+    def upload(self, name, content):
+        response = self.client.post(self.url('/voter/upload'), {'file': SimpleUploadedFile(name, content)})
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_csv(self):
+        # header with the email column, semicolon as delimiter and repeated emails
+        content = ('Name;E-Mail\nA;voter0@example.com\nB;voter0@example.com\nC;new@example.com\nD;invalid\n')
+        lines = self.upload('roster.csv', content.encode())
+        self.assertEqual(lines[0]['batch']['rejected'], {'voter0@example.com': 'existing', 'invalid': 'invalid'})
+        self.assertEqual(lines[-1], {'processed': 4, 'accepted': 1, 'rejected': 3, 'voters': 4})
+        self.assertTrue(Voter.objects.filter(election=self.election, email='new@example.com').exists())
+
+    def test_csv_without_header(self):
+        lines = self.upload('roster.csv', b'new0@example.com\nnew1@example.com\n')
+        self.assertEqual(lines[-1], {'processed': 2, 'accepted': 2, 'rejected': 0, 'voters': 5})
+
+    def test_empty_lines(self):
+        lines = self.upload('roster.csv', b'\nemail\n\nnew@example.com\n')
+        self.assertEqual(lines[-1], {'processed': 1, 'accepted': 1, 'rejected': 0, 'voters': 4})
+
+    def test_invalid_values(self):
+        content = 'new0@example.com\nnew\x001@example.com\n%s@example.com\n' % ('x' * 300)
+        lines = self.upload('roster.csv', content.encode())
+        self.assertEqual(set(lines[0]['batch']['rejected'].values()), {'invalid'})
+        self.assertEqual(lines[-1], {'processed': 3, 'accepted': 1, 'rejected': 2, 'voters': 4})
+
+    def test_xlsx(self):
+        workbook = Workbook()
+        for row in (['name', 'email'], ['A', 'new0@example.com'], ['B', 'voter1@example.com']):
+            workbook.active.append(row)
+        file = io.BytesIO()
+        workbook.save(file)
+        lines = self.upload('roster.xlsx', file.getvalue())
+        self.assertEqual(lines[-1], {'processed': 2, 'accepted': 1, 'rejected': 1, 'voters': 4})
+
+    def test_bad_file(self):
+        lines = self.upload('roster.xlsx', b'not a workbook')
+        self.assertIn('error', lines[-1])
+        self.assertEqual(Voter.objects.filter(election=self.election).count(), 3)
+        response = self.client.post(self.url('/voter/upload'), {'file': SimpleUploadedFile('roster.txt', b'')})
+        self.assertEqual(response.status_code, 400)
+
+
+class OutboxTest(ElectionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # new connection pool with the test email backend
+        patcher = mock.patch('elections.mail._pool', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.post(self.url('/start'))
+
+    def test_send(self):
+        # one email for every voter is queued when the election starts
+        self.assertEqual(OutboxEmail.objects.filter(election=self.election, status=OutboxEmail.PENDING).count(), 3)
+        self.assertEqual(send_emails(), 3)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         ['voter%d@example.com' % i for i in range(3)])
+        self.assertIn('TOKEN0', next(message.body for message in mail.outbox if 'voter0' in message.to[0]))
+        self.assertFalse(OutboxEmail.objects.exclude(status=OutboxEmail.SENT, token='').exists())
+        self.assertEqual(send_emails(), 0)
+
+    @mock.patch.object(connection.features, 'has_select_for_update_skip_locked', True)
+    def test_claim(self):
+        # claimed emails are not sent by other workers
+        self.assertEqual(len(claim_emails(10, timezone.now())), 3)
+        self.assertEqual(len(claim_emails(10, timezone.now())), 0)
+        # unless the result is not recorded in time
+        later = timezone.now() + timezone.timedelta(seconds=config.EMAIL_CLAIM_TIMEOUT + 1)
+        self.assertEqual(len(claim_emails(10, later)), 3)
+
+    def test_claim_without_skip_locked(self):
+        # emails are claimed by conditional updates if the database cannot skip locked rows
+        with mock.patch.object(connection.features, 'has_select_for_update_skip_locked', False):
+            now = timezone.now()
+            claimed = claim_emails(2, now)
+            self.assertEqual(len(claimed), 2)
+            self.assertEqual(len(claim_emails(10, now)), 1)
+            self.assertEqual(len(claim_emails(10, now)), 0)
+        self.assertTrue(all(email.next_attempt > now for email in claimed))
+
+    def test_retry(self):
+        with mock.patch.object(ConnectionPool, 'send', side_effect=SMTPException('unavailable')):
+            self.assertEqual(send_emails(), 3)
+            email = OutboxEmail.objects.get(token='TOKEN0')
+            self.assertEqual((email.status, email.attempts, email.error), (OutboxEmail.PENDING, 1, 'unavailable'))
+            # retried later, twice as long after every attempt
+            self.assertEqual(send_emails(), 0)
+            delay = email.next_attempt - timezone.now()
+            self.assertTrue(config.EMAIL_RETRY_DELAY - 5 < delay.total_seconds() <= config.EMAIL_RETRY_DELAY)
+            OutboxEmail.objects.update(next_attempt=timezone.now())
+            send_emails()
+            delay = OutboxEmail.objects.get(token='TOKEN0').next_attempt - timezone.now()
+            self.assertGreater(delay.total_seconds(), config.EMAIL_RETRY_DELAY * 2 - 5)
+            # and given up after too many attempts
+            OutboxEmail.objects.update(next_attempt=timezone.now())
+            with mock.patch.object(config, 'EMAIL_MAX_ATTEMPTS', 3):
+                send_emails()
+        self.assertEqual(OutboxEmail.objects.filter(status=OutboxEmail.FAILED, attempts=3).count(), 3)
+        self.assertEqual(send_emails(), 0)
+
+    def test_ended(self):
+        self.client.post(self.url('/end'))
+        self.assertEqual(send_emails(), 3)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboxEmail.objects.filter(status=OutboxEmail.FAILED, error='Election has ended').count(), 3)
+
+
+class FakeBackend(BaseEmailBackend):
+    # counts the opened connections, the next send fails if the server has dropped the connection
+    backends = []
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.opened = 0
+        self.connected = False
+        self.dropped = False
+        self.sent = []
+        self.backends.append(self)
+
+    def open(self):
+        if not self.connected:
+            self.opened += 1
+            self.connected = True
+
+    def close(self):
+        self.connected = False
+        self.dropped = False
+
+    def send_messages(self, messages):
+        if self.dropped:
+            raise SMTPServerDisconnected('Connection unexpectedly closed')
+        self.sent.extend(messages)
+        return len(messages)
+
+
+@override_settings(EMAIL_BACKEND='elections.tests.FakeBackend')
+class ConnectionPoolTest(SimpleTestCase):
+
+    def setUp(self):
+        FakeBackend.backends = []
+
+    def test_messages_per_connection(self):
+        pool = ConnectionPool(1, 2, 0)
+        for i in range(5):
+            pool.send(EmailMessage(to=['voter%d@example.com' % i]))
+        backend, = FakeBackend.backends
+        self.assertEqual((len(backend.sent), backend.opened), (5, 3))
+        pool.close()
+        self.assertFalse(backend.connected)
+
+    def test_disconnected(self):
+        pool = ConnectionPool(1, 100, 0)
+        pool.send(EmailMessage(to=['voter0@example.com']))
+        backend, = FakeBackend.backends
+        # the server dropped the idle connection, the message is sent over a new one
+        backend.dropped = True
+        pool.send(EmailMessage(to=['voter1@example.com']))
+        self.assertEqual((len(backend.sent), backend.opened), (2, 2))
+
+    def test_rate(self):
+        with mock.patch('elections.mail.time.monotonic', return_value=100.0), \
+                mock.patch('elections.mail.time.sleep') as sleep:
+            limiter = RateLimiter(4)
+            for _ in range(4):
+                limiter.wait()
+        # every message waits for its own slot
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [0, 0.25, 0.5, 0.75])
+
+
+class EmailTemplateTest(ElectionTestCase):
+    invitation = '<html><head><style>p {}</style></head><body><p>{{ election_name }}</p>\n' \
+                 '<p><a href="{{ hostname }}/vote/{{ token }}">Abstimmen</a></p></body></html>'
+
+    def render(self, source, token):
+        with mock.patch('elections.mail.get_template', return_value=engines['django'].from_string(source)):
+            template = EmailTemplate(self.election, False, '2021')
+            return template.compiled, template.render(token)
+
+    def test_link(self):
+        # the token is only part of the voting link
+        compiled, (body, text) = self.render(self.invitation, 'TOKEN0')
+        self.assertTrue(compiled)
+        self.assertIn('href="http://localhost/vote/TOKEN0"', body)
+        self.assertEqual(text, 'Election\nAbstimmen (http://localhost/vote/TOKEN0)')
+
+    def test_changed_token(self):
+        # the template changes the token, every email is rendered
+        compiled, (body, text) = self.render(self.invitation.replace('{{ token }}', '{{ token|lower }}'), 'TOKEN0')
+        self.assertFalse(compiled)
+        self.assertIn('(http://localhost/vote/token0)', text)
+
+
+class ReportTest(ElectionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.start()
+        patcher = mock.patch('elections.reports.render_report', return_value=b'%PDF-1.7')
+        self.render = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_stored(self):
+        self.client.post(self.url('/end'))
+        response = self.client.get(self.url('/results'))
+        self.assertEqual((response.status_code, response.content), (200, b'%PDF-1.7'))
+        self.assertEqual(Report.objects.filter(election=self.election).count(), 1)
+        # the stored report is served without rendering it again
+        self.assertEqual(self.client.get(self.url('/results')).content, b'%PDF-1.7')
+        self.assertEqual(self.render.call_count, 1)
+
+    def test_not_modified(self):
+        self.client.post(self.url('/end'))
+        etag = self.client.get(self.url('/results'))['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url('/results'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # the pdf is not loaded for an unchanged report
+        self.assertFalse([query for query in queries if '"pdf"' in query['sql']])
+
+    def test_template_changed(self):
+        self.client.post(self.url('/end'))
+        etag = self.client.get(self.url('/results'))['ETag']
+        with mock.patch('elections.reports.template_version', return_value='changed'):
+            response = self.client.get(self.url('/results'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.render.call_count, 2)
+        self.assertEqual(Report.objects.filter(election=self.election).count(), 2)
+
+    def test_pregenerate(self):
+        with mock.patch.object(config, 'REPORT_PREGENERATE', True):
+            self.client.post(self.url('/end'))
+        self.assertTrue(Report.objects.filter(election=self.election).exists())
+        self.assertEqual(self.client.get(self.url('/results')).status_code, 200)
+        self.assertEqual(self.render.call_count, 1)
+
+    def test_pregenerate_error(self):
+        # the election ends even if its report cannot be rendered
+        self.render.side_effect = OSError('disk full')
+        with mock.patch.object(config, 'REPORT_PREGENERATE', True), self.assertLogs('elections.views', 'ERROR'):
+            response = self.client.post(self.url('/end'))
+        self.assertEqual(response.status_code, 200)
+        self.election.refresh_from_db()
+        self.assertIsNotNone(self.election.end_date)
+        self.assertFalse(Report.objects.filter(election=self.election).exists())
+
+    def test_template_version(self):
+        # the template is read only once
+        reports.template_version()
+        with mock.patch('builtins.open') as template:
+            reports.template_version()
+        template.assert_not_called()
+
+
+class RenderReportTest(SimpleTestCase):
+
+    def setUp(self):
+        self.executor = mock.Mock()
+        patcher = mock.patch('elections.reports._executor', self.executor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.jobs = reports._jobs._value
+
+    def test_broken(self):
+        future = Future()
+        future.set_exception(BrokenProcessPool())
+        self.executor.submit.return_value = future
+        with self.assertRaises(ReportUnavailable):
+            render_report('<html></html>')
+        # a new pool is started for the next report
+        self.assertIsNone(reports._executor)
+        self.assertEqual(reports._jobs._value, self.jobs)
+        self.executor.submit.side_effect = BrokenProcessPool()
+        reports._executor = self.executor
+        with self.assertRaises(ReportUnavailable):
+            render_report('<html></html>')
+        self.assertIsNone(reports._executor)
+        self.assertEqual(reports._jobs._value, self.jobs)
+
+    def test_timeout(self):
+        waiting, running = Future(), Future()
+        running.set_running_or_notify_cancel()
+        self.executor.submit.side_effect = [waiting, running]
+        with mock.patch.object(config, 'REPORT_TIMEOUT', 0.01):
+            for _ in range(2):
+                with self.assertRaises(ReportUnavailable):
+                    render_report('<html></html>')
+        # the waiting job is dropped, the running one counts until it has finished
+        self.assertTrue(waiting.cancelled())
+        self.assertEqual(reports._jobs._value, self.jobs - 1)
+        running.set_result(b'%PDF-1.7')
+        self.assertEqual(reports._jobs._value, self.jobs)
+
+
+class VoterListTest(ElectionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        Voter.objects.filter(token='TOKEN1').update(voted=True)
+
+    def get(self, query):
+        response = self.client.get(self.url('/voter') + query)
+        self.assertEqual(response.status_code, 200)
+        return [voter['email'] for voter in response.data['voters']], response.data['next']
+
+    def test_pages(self):
+        self.assertEqual(self.get('?limit=2'), (['voter0@example.com', 'voter1@example.com'], 'voter1@example.com'))
+        self.assertEqual(self.get('?limit=2&after=voter1@example.com'), (['voter2@example.com'], None))
+
+    def test_filter(self):
+        self.assertEqual(self.get('?voted=true'), (['voter1@example.com'], None))
+        self.assertEqual(self.get('?voted=false&search=voter2'), (['voter2@example.com'], None))
+        self.assertEqual(self.get('?search=other'), ([], None))
+
+    def test_invalid(self):
+        response = self.client.get(self.url('/voter') + '?limit=0')
+        self.assertEqual(response.status_code, 400)
+
+
+class ElectionListTest(ElectionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        for i in range(4):
+            Election.objects.create(name='Running %d' % i, owner=self.user, start_date=now,
+                                    creation_date=now - timezone.timedelta(days=i + 1))
+
+    def test_pages(self):
+        response = self.client.get('/api/v1/election?limit=3')
+        self.assertEqual([election['name'] for election in response.data['results']],
+                         ['Election', 'Running 0', 'Running 1'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([election['name'] for election in response.data['results']], ['Running 2', 'Running 3'])
+        self.assertIsNone(response.data['next'])
+
+    def test_state(self):
+        response = self.client.get('/api/v1/election?state=draft')
+        self.assertEqual([election['name'] for election in response.data['results']], ['Election'])
+        self.assertEqual(response.data['counts'], {'draft': 1, 'running': 4, 'paused': 0, 'closed': 0})
+        response = self.client.get('/api/v1/election?state=unknown')
+        self.assertEqual(response.status_code, 400)
+
+
+class ExplainQueriesTest(ElectionTestCase):
+
+    def test_analyze(self):
+        # analyze is not supported by every database, the plans are shown anyway
+        stdout = io.StringIO()
+        call_command('explain_queries', analyze=True, stdout=stdout, stderr=io.StringIO())
+        self.assertIn('vote: voter by token', stdout.getvalue())
+
+
+class SelfcheckTest(TestCase):
+
+    def setUp(self):
+        # the connection of the test case stays open
+        patcher = mock.patch('elections.management.commands.selfcheck.connections')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_healthy(self):
+        stdout = io.StringIO()
+        call_command('selfcheck', stdout=stdout)
+        self.assertEqual(stdout.getvalue().count(': ok'), len(health.CHECKS))
+
+    def test_failing(self):
+        stdout = io.StringIO()
+        with mock.patch.object(config, 'REPORT_TEMPLATE', 'missing.html'), \
+                self.assertRaisesMessage(CommandError, '1 checks failed'):
+            call_command('selfcheck', stdout=stdout)
+        self.assertIn('templates: TemplateNotFound: missing.html', stdout.getvalue())
+        self.assertIn('database: ok', stdout.getvalue())
+
+
+class BallotCacheTest(ElectionTestCase):
+
+    def test_pause(self):
+        self.client.post(self.url('/start'))
+        self.assertEqual(self.client.get('/api/v1/vote/TOKEN0').status_code, 200)
+        self.client.post(self.url('/pause'))
+        self.assertEqual(self.client.get('/api/v1/vote/TOKEN0').status_code, 403)
+        self.client.post(self.url('/pause'))
+        self.assertEqual(self.client.get('/api/v1/vote/TOKEN0').status_code, 200)
+
+    def test_options(self):
+        self.assertEqual(self.client.get('/api/v1/vote/TOKEN0').status_code, 403)
+        self.client.post(self.url('/option'), {'options': ['D']}, content_type='application/json')
+        self.client.post(self.url('/start'))
+        self.assertEqual(self.client.get('/api/v1/vote/TOKEN0').data['options'], ['A', 'B', 'C', 'D'])
+
+
+class UserCacheTest(ElectionTestCase):
+
+    def test_user(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/user')
+        self.assertEqual(response.data, {'name': 'owner@example.com'})
+        # user and profile are cached
+        with self.assertNumQueries(0):
+            self.client.get('/api/v1/user')
+        # and fetched again after a change
+        self.user.first_name = 'Owner'
+        self.user.save()
+        self.assertEqual(self.client.get('/api/v1/user').data, {'name': 'Owner'})
+
+    def test_cached_fields(self):
+        self.user.set_password('password')
+        self.user.save()
+        self.client.force_login(self.user)
+        self.client.get('/api/v1/user')
+        # the password hash is not cached
+        self.assertNotIn(self.user.password, str(cache.get(user_key(self.user.id))))
+        self.user.set_password('secret')
+        self.user.save()
+        # the session is invalid after the password has changed
+        self.assertEqual(self.client.get('/api/v1/user').status_code, 401)
+
+    def test_save(self):
+        request = mock.Mock(session=self.client.session)
+        user = get_user(request)
+        self.assertEqual((user.id, user.email), (self.user.id, 'owner@example.com'))
+        # the cached user only saves its own fields, the password is kept
+        user.first_name = 'Owner'
+        user.save()
+        self.assertEqual(User.objects.get(id=self.user.id).password, self.user.password)
+        self.assertEqual(User.objects.get(id=self.user.id).first_name, 'Owner')
+
+    def test_stats(self):
+        self.assertEqual(self.client.get('/api/v1/cache/stats').status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get('/api/v1/cache/stats')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(response.data['user']['misses'], 0)
+
+
+class MetricsTest(ElectionTestCase):
+
+    def metrics(self):
+        with mock.patch.object(config, 'METRICS_TOKEN', 'secret'):
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_metrics(self):
+        self.client.get(self.url())
+        metrics = self.metrics()
+        self.assertIn('elex_request_duration_seconds_count{view="ElectionDetail"}', metrics)
+        self.assertIn('elex_db_queries_total{view="ElectionDetail"}', metrics)
+
+    def test_token(self):
+        # not served without a token
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        with mock.patch.object(config, 'METRICS_TOKEN', 'secret'):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer other').status_code, 403)
+
+    def test_workers(self):
+        # the metrics of the other workers are added
+        self.client.get(self.url())
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory), \
+                mock.patch('elections.metrics._start_flusher'):
+            own = re.search(r'elex_request_duration_seconds_count{view="ElectionDetail"} (\d+)', self.metrics())
+            with open(os.path.join(directory, 'other.json'), 'w') as file:
+                json.dump({'requests': {'ElectionDetail': 2}, 'buckets': {'ElectionDetail': [2] * len(BUCKETS)},
+                           'seconds': {'ElectionDetail': 0.5}, 'cache': {'ballot': {'hits': 1, 'misses': 0}}}, file)
+            metrics = self.metrics()
+        self.assertIn('elex_request_duration_seconds_count{view="ElectionDetail"} %d' % (int(own.group(1)) + 2),
+                      metrics)
+        self.assertIn('elex_cache_hits_total{cache="ballot"}', metrics)
+
+    def test_server_timing(self):
+        with mock.patch.object(config, 'METRICS_SERVER_TIMING', True):
+            response = self.client.get(self.url())
+        self.assertIn('db;dur=', response['Server-Timing'])
+
+
+class AsyncVoteTest(ElectionSetup, TransactionTestCase):
+    # queries of the async view run in other threads, they must see the committed test data
+
+    def setUp(self):
+        super().setUp()
+        self.start()
+        self.factory = AsyncRequestFactory()
+
+    async def test_get(self):
+        response = await vote_async(self.factory.get('/api/v1/vote/TOKEN0'), 'TOKEN0')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['options'], ['A', 'B', 'C'])
+
+    async def test_connections(self):
+        # the whole vote runs in one call, its connection is closed like at the end of a request before and after it
+        with mock.patch('elections.views.close_old_connections') as close_old_connections:
+            request = self.factory.post('/api/v1/vote/TOKEN0', {'votes': [0]}, content_type='application/json')
+            response = await vote_async(request, 'TOKEN0')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(close_old_connections.call_count, 2)
+
+    async def test_post(self):
+        request = self.factory.post('/api/v1/vote/TOKEN0', {'votes': [0, 2]}, content_type='application/json')
+        self.assertEqual((await vote_async(request, 'TOKEN0')).status_code, 200)
+        # voted already
+        request = self.factory.post('/api/v1/vote/TOKEN0', {'votes': [0]}, content_type='application/json')
+        self.assertEqual((await vote_async(request, 'TOKEN0')).status_code, 403)
+        request = self.factory.post('/api/v1/vote/TOKEN1', {'votes': [5]}, content_type='application/json')
+        self.assertEqual((await vote_async(request, 'TOKEN1')).status_code, 400)
+
+
+@skipUnless('replica0' in settings.DATABASES,
+            'run with ELEX_DB_ENGINE=sqlite3 and a second sqlite file as ELEX_DB_REPLICAS')
+class ReplicaTest(ElectionTestCase):
+    # the replica is a separate (empty) database, so reads from it do not find the election
+    databases = '__all__'
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(config, 'REPLICA_READS', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_replica_reads(self):
+        self.assertEqual(self.client.get(self.url()).status_code, 404)
+        self.assertEqual(self.client.get('/api/v1/election').data['results'], [])
+
+    def test_primary(self):
+        # votes are not read from a replica
+        self.start()
+        self.assertEqual(self.client.get('/api/v1/vote/TOKEN0').status_code, 200)
+
+    def test_read_your_writes(self):
+        response = self.client.patch(self.url(), {'name': 'Renamed'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        # reads of the user go to the primary for a while after a change, also on other workers (own cache)
+        cache.clear()
+        self.assertEqual(self.client.get(self.url()).data['name'], 'Renamed')
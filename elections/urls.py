@@ -1,21 +1,27 @@
 from django.urls import path
 
 from . import views
-from elex import settings
+from elex import config, settings
 
 
 urlpatterns = [
-    path('vote/<str:token>', views.VoteView.as_view()),
+    path('vote/<str:token>', views.vote_async if config.ASYNC_VOTE else views.VoteView.as_view()),
     path('user', views.UserView.as_view()),
+    path('cache/stats', views.CacheStats.as_view()),
     path('election', views.ElectionList.as_view()),
+    path('election/results/<str:fmt>', views.ResultsExportList.as_view()),
     path('election/<int:election_id>', views.ElectionDetail.as_view()),
     path('election/<int:election_id>/start', views.StartElection.as_view()),
     path('election/<int:election_id>/end', views.EndElection.as_view()),
     path('election/<int:election_id>/pause', views.PauseElection.as_view()),
     path('election/<int:election_id>/remind', views.VoteReminder.as_view()),
     path('election/<int:election_id>/results', views.PDFResults.as_view()),
+    path('election/<int:election_id>/results/<str:fmt>', views.ResultsExport.as_view()),
     path('election/<int:election_id>/voter', views.VoterList.as_view()),
+    path('election/<int:election_id>/voter/import', views.VoterImport.as_view()),
+    path('election/<int:election_id>/voter/upload', views.VoterUpload.as_view()),
     path('election/<int:election_id>/voter/<str:email>', views.VoterDetail.as_view()),
     path('election/<int:election_id>/option', views.OptionList.as_view()),
     path('election/<int:election_id>/option/<int:index>', views.OptionDetail.as_view()),
+    path('election/<int:election_id>/option/id/<int:option_id>', views.OptionDetail.as_view()),
 ]
\ No newline at end of file
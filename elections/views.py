@@ -1,93 +1,96 @@
+import csv
 import datetime
-import jinja2
-import pandas as pd
-import pytz
-from django.core.mail import get_connection, EmailMultiAlternatives
-from django.http import Http404, FileResponse, HttpResponse
-from django.template.loader import get_template, render_to_string
+import io
+import itertools
+import json
+import logging
+import zipfile
+from django.http import Http404, FileResponse, HttpResponse, HttpResponseNotAllowed, JsonResponse, \
+    StreamingHttpResponse
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Q
 from rest_framework import status
+from rest_framework.pagination import CursorPagination
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from weasyprint import HTML, CSS
-from weasyprint.fonts import FontConfiguration
 from elex import config
 
+from elections.caching import cache_stats, cached, profile_key
+from elections.mail import queue_emails
+from elections.metrics import render_metrics
+from elections.reports import ReportUnavailable, get_report, results_csv, results_json
 from elections.serializers import *
+from elections.votes import cast_vote, create_counters, merge_counters, tally_ballots, verify_ballots
 from elex import settings
 
+logger = logging.getLogger(__name__)
 
-def create_report(results, election):
-    # get options (names) and votes (number of votes)
-    options = results.keys()
-    votes = results.values()
 
-    today = datetime.datetime.today()
-    # save information in meta dict
-    meta = {
-        "election": {
-            "name": election.name,
-            "description": election.description,
-            "voters": election.voters,
-            "votes": sum(votes),
-            "voted": election.voted,
-            "votable": election.votable,
-            "start": election.start_date.replace(tzinfo=pytz.UTC)
-                .astimezone(timezone.get_current_timezone()).strftime("%d/%m/%Y, %H:%M Uhr"),
-            "end": election.end_date.replace(tzinfo=pytz.UTC)
-                .astimezone(timezone.get_current_timezone()).strftime("%d/%m/%Y, %H:%M Uhr"),        },
-        "year": today.strftime("%Y"),
-        "date": today.strftime("%d/%m/%Y, %H:%M Uhr")
-    }
-
-    # convert results data to data frame (table)
-    results = pd.DataFrame(data=votes, index=options)
-    # get template and fill in the data (render)
-    templateLoader = jinja2.FileSystemLoader(searchpath="./elections/templates/")
-    templateEnv = jinja2.Environment(loader=templateLoader)
-    template = templateEnv.get_template(config.REPORT_TEMPLATE)
-    html = template.render(results=results, meta=meta)
-
-    # create Response and save pdf to it
-    response = HttpResponse(content_type='application/pdf;')
-    pdf = HTML(string=html)
-    pdf.write_pdf(response)
-    return response
-
-
-def send_emails(voters, election, reminder=False):
-    year = datetime.date.today().strftime("%Y")
-    subject = 'Wahl: ' + election.name
-
-    if reminder:
-        subject = 'Erinnerung - ' + subject
-        template = get_template(config.EMAIL_REMIND_TEMPLATE)
+def read_roster(file):
+    if file.name.lower().endswith('.xlsx'):
+        # read only mode loads the rows lazily
+        from openpyxl import load_workbook
+        rows = load_workbook(file, read_only=True).active.iter_rows(values_only=True)
     else:
-        template = get_template(config.EMAIL_TEMPLATE)
-
-    connection = get_connection(fail_silently=False)
-    messages = []
-
-    for voter in voters:
-        msg = EmailMultiAlternatives(
-            subject=subject,
-            body='',
-            to=[voter.email],
-            reply_to=[election.owner.email]
-        )
-        context = {
-            "election_name": election.name,
-            "token": voter.token,
-            "owner_email": election.owner.email,
-            "year": year,
-            "hostname": config.HOSTNAME
-        }
-        msg.attach_alternative(template.render(context), 'text/html')
-        messages.append(msg)
-    return connection.send_messages(messages)
+        file = io.TextIOWrapper(file, encoding='utf-8-sig')
+        # detect the delimiter of the csv export
+        try:
+            dialect = csv.Sniffer().sniff(file.read(4096), delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        file.seek(0)
+        rows = csv.reader(file, dialect)
+
+    column = None
+    for row in rows:
+        values = ['' if value is None else str(value).strip() for value in row]
+        if not any(values):
+            # empty line, also before the header
+            continue
+        if column is None:
+            column = 0
+            # use the email column if the first row is a header
+            header = [value.lower() for value in values]
+            for name in ('email', 'e-mail', 'mail'):
+                if name in header:
+                    column = header.index(name)
+                    break
+            if '@' not in values[column]:
+                continue
+        if column < len(values) and values[column]:
+            yield values[column]
+
+
+def ballot_key(election_id):
+    return 'ballot-%d' % election_id
+
+
+def clear_ballot(election):
+    # election or options changed, the ballot page is loaded again on the next request
+    cache.delete(ballot_key(election.id))
+
+
+class ElectionPagination(CursorPagination):
+    # newest elections first, backed by the (owner, creation_date) index
+    ordering = '-creation_date'
+    page_size = config.ELECTION_PAGE_SIZE
+    page_size_query_param = 'limit'
+    max_page_size = config.ELECTION_PAGE_MAX
 
 
 class ElectionAPI(APIView):
+    # filter for the elections in every state, same states as get_state
+    states = {
+        'draft': Q(paused=0, start_date__isnull=True),
+        'running': Q(paused=0, start_date__isnull=False, end_date__isnull=True),
+        'paused': Q(paused=1),
+        'closed': Q(paused=0, end_date__isnull=False),
+    }
 
     def get_election(self, election_id):
         try:
@@ -97,21 +100,33 @@ class ElectionAPI(APIView):
 
     def get_admin_election(self, election_id, user):
         election = self.get_election(election_id)
-        if election.owner != user:
+        # compare ids, so the owner does not have to be fetched
+        if election.owner_id != user.id:
             # return None if user does not own this election
             return None
         return election
 
-    def get_option(self, election_id, index):
+    def get_option(self, election_id, index=None, option_id=None):
+        options = Option.objects.filter(election_id=election_id)
         try:
+            if option_id is not None:
+                # return the option with the given id for the requested election
+                return options.get(id=option_id)
             # return the option at index for the requested election
-            return Option.objects.filter(election_id=election_id)[index]
-        except IndexError:
-            # if index to big option was not found (because not existing)
+            return options[index]
+        except (IndexError, Option.DoesNotExist):
+            # if index to big or id of another election, option was not found
             raise Http404
 
-    def get_state(self, election_id):
-        election = self.get_election(election_id)
+    def add_voters(self, election, state, serializer):
+        # validate, deduplicate and insert all voters in bulk
+        voters = serializer.save(election=election)
+        # if election already in progress, send the links
+        if abs(state) == 1:
+            queue_emails(voters, election)
+        return serializer.report
+
+    def get_state(self, election):
         if election.paused == 1:
             # election is paused
             return -1
@@ -128,51 +143,54 @@ class ElectionAPI(APIView):
 class VoteView(ElectionAPI):
     def get_voter(self, token):
         try:
-            voter = Voter.objects.get(token=token)
-            election = self.get_election(voter.election_id)
-            return voter, election
+            # only the voter itself, the election is part of the cached ballot
+            return Voter.objects.only('election_id', 'voted').get(token=token)
         except Voter.DoesNotExist:
             raise Http404
 
-    def get(self, request, token):
-        voter, election = self.get_voter(token)
-        # only if election is in progress and voter has not voted yet, voting is allowed
-        if self.get_state(election.id) != 1 or voter.voted == 1:
-            return Response({"voted": voter.voted}, status=status.HTTP_403_FORBIDDEN)
-
-        ret = {
+    def load_ballot(self, election_id):
+        # election and owner with one query, options with another
+        election = Election.objects.select_related('owner').get(id=election_id)
+        options = list(Option.objects.filter(election_id=election_id).values_list('id', 'name'))
+        return {
+            "state": self.get_state(election),
+            "ledger": election.ledger,
             "name": election.name,
             "description": election.description,
             "owner": election.owner.email,
             "votable": election.votable,
-            "options": []
+            "options": [name for _, name in options],
+            "option_ids": [option_id for option_id, _ in options]
         }
 
-        for option in Option.objects.filter(election_id=election.id).values():
-            ret["options"].append(option.get('name'))
+    def get_ballot(self, election_id):
+        return cached('ballot', ballot_key(election_id), lambda: self.load_ballot(election_id),
+                      config.BALLOT_CACHE_TIMEOUT)
+
+    def get(self, request, token):
+        voter = self.get_voter(token)
+        ballot = self.get_ballot(voter.election_id)
+        # only if election is in progress and voter has not voted yet, voting is allowed
+        if ballot.get('state') != 1 or voter.voted == 1:
+            return Response({"voted": voter.voted}, status=status.HTTP_403_FORBIDDEN)
+
+        ret = {key: value for key, value in ballot.items() if key not in ('state', 'ledger')}
         return Response(ret, status=status.HTTP_200_OK)
 
     def post(self, request, token):
-        voter, election = self.get_voter(token)
+        voter = self.get_voter(token)
+        ballot = self.get_ballot(voter.election_id)
         # only if election is in progress and voter has not voted yet, voting is allowed
-        if self.get_state(election.id) != 1 or voter.voted == 1:
+        # (a stale cache does not matter here, cast_vote checks the state of the election again)
+        if ballot.get('state') != 1 or voter.voted == 1:
             return Response(status=status.HTTP_403_FORBIDDEN)
-        # get all available options for this election
-        options = Option.objects.filter(election_id=election.id).count()
-        serializer = VoteSerializer(data=request.data, options=options, votable=election.votable)
+        serializer = VoteSerializer(data=request.data, options=ballot.get('option_ids'), votable=ballot.get('votable'))
         # if all the provided votes are valid
         if serializer.is_valid():
-            for vote in serializer.data.get('votes'):
-                option = self.get_option(election.id, vote)
-                # increase votes for voted option
-                option.votes = option.votes + 1
-                option.save()
-            # increase total number of people who voted
-            election.voted = election.voted + 1
-            election.save()
-            # voter has just voted, set voted to true (1)
-            voter.voted = 1
-            voter.save()
+            # count the whole ballot in one transaction
+            if not cast_vote(voter, serializer.validated_data.get('options'), ballot.get('ledger')):
+                # voter has already voted or election is not in progress anymore
+                return Response(status=status.HTTP_403_FORBIDDEN)
             return Response(status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -183,23 +201,66 @@ class UserView(APIView):
             # user is not logged in
             return Response(status=status.HTTP_401_UNAUTHORIZED)
 
-        name = request.user.first_name
-        if len(name) == 0:
-            name = request.user.email
-        ret = {"name": name}
+        ret = cached('profile', profile_key(request.user.id), lambda: self.get_profile(request.user),
+                     config.USER_CACHE_TIMEOUT)
         return Response(ret, status=status.HTTP_200_OK)
 
+    def get_profile(self, user):
+        name = user.first_name
+        if len(name) == 0:
+            name = user.email
+        return {"name": name}
+
+
+class CacheStats(APIView):
+    def get(self, request):
+        if not request.user.is_authenticated:
+            # user is not logged in
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+        if not request.user.is_staff:
+            return Response(status=status.HTTP_403_FORBIDDEN)
+        # hits and misses of the cached values of this process
+        return Response(cache_stats(), status=status.HTTP_200_OK)
+
+
+class Metrics(APIView):
+    # no session, the metrics are read by the monitoring
+    authentication_classes = []
+    permission_classes = []
+
+    def get(self, request):
+        # the metrics are never public, they are not served until a token is configured
+        if not config.METRICS_TOKEN or request.META.get('HTTP_AUTHORIZATION') != 'Bearer ' + config.METRICS_TOKEN:
+            return Response(status=status.HTTP_403_FORBIDDEN)
+        return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 
 class ElectionList(ElectionAPI):
+    # GET requests may read from a replica
+    replica_reads = True
+
     def get(self, request):
         if not request.user.is_authenticated:
             # user is not logged in
             return Response(status=status.HTTP_401_UNAUTHORIZED)
-        # get all elections of the loggedin user and return them
-        elections = Election.objects.all()\
-            .filter(owner=request.user).order_by('-creation_date')
-        serializer = ElectionSerializer(elections, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        elections = Election.objects.filter(owner_id=request.user.id)
+        # number of elections of the logged in user in every state
+        counts = elections.aggregate(**{'count_' + state: Count('id', filter=q) for state, q in self.states.items()})
+        counts = {state: counts.get('count_' + state) for state in self.states}
+
+        state = request.query_params.get('state')
+        if state is not None:
+            if state not in self.states:
+                return Response({"state": ["Unknown state."]}, status=status.HTTP_400_BAD_REQUEST)
+            elections = elections.filter(self.states[state])
+
+        # return one page of the elections, e.g. ?state=running&cursor=...
+        paginator = ElectionPagination()
+        page = paginator.paginate_queryset(elections, request, view=self)
+        serializer = ElectionSerializer(page, many=True)
+        response = paginator.get_paginated_response(serializer.data)
+        response.data['counts'] = counts
+        return response
 
     def post(self, request):
         if not request.user.is_authenticated:
@@ -214,6 +275,9 @@ class ElectionList(ElectionAPI):
 
 
 class ElectionDetail(ElectionAPI):
+    # GET requests may read from a replica
+    replica_reads = True
+
     def get(self, request, election_id):
         if not request.user.is_authenticated:
             # user is not logged in
@@ -223,7 +287,8 @@ class ElectionDetail(ElectionAPI):
         if election is None:
             # logged in user does not own the requested election
             return Response(status=status.HTTP_403_FORBIDDEN)
-        serializer = ElectionDetailSerializer(election)
+        # only the requested sections, e.g. ?include=options,results
+        serializer = ElectionDetailSerializer(election, context={'include': request.query_params.get('include')})
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def patch(self, request, election_id):
@@ -236,11 +301,12 @@ class ElectionDetail(ElectionAPI):
             # logged in user does not own the requested election
             return Response(status=status.HTTP_403_FORBIDDEN)
         # changing election only possible when it has not started yet
-        if self.get_state(election.id) == 0:
+        if self.get_state(election) == 0:
             # update the election with the received payload
             serializer = ElectionDetailSerializer(election, data=request.data, partial=True)
             if serializer.is_valid():
                 serializer.save()
+                clear_ballot(election)
                 return Response(serializer.data, status=status.HTTP_200_OK)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         return Response(status=status.HTTP_403_FORBIDDEN)
@@ -259,10 +325,14 @@ class StartElection(ElectionAPI):
         number_of_options = Option.objects.filter(election_id=election.id).count()
         # starting election only possible when it has not started yet and when there is at least one
         # voter and two vote options
-        if self.get_state(election.id) == 0 and number_of_options >= 2:
+        if self.get_state(election) == 0 and number_of_options >= 2:
             election.start_date = timezone.now()
-            election.save()
-            send_emails(Voter.objects.filter(election_id=election.id), election)
+            # the votes of the election are counted the same way until it ends
+            election.ledger = config.VOTE_LEDGER
+            election.save(update_fields=['start_date', 'ledger'])
+            clear_ballot(election)
+            create_counters(election)
+            queue_emails(Voter.objects.filter(election_id=election.id), election)
             return Response(election.start_date, status=status.HTTP_200_OK)
         return Response(status=status.HTTP_403_FORBIDDEN)
 
@@ -278,11 +348,39 @@ class EndElection(ElectionAPI):
             # logged in user does not own the requested election
             return Response(status=status.HTTP_403_FORBIDDEN)
         # ending election only possible when it is in progress
-        if abs(self.get_state(election.id)) == 1:
-            election.end_date = timezone.now()
-            election.paused = 0
-            election.save()
-            Voter.objects.filter(election_id=election.id).delete()
+        if abs(self.get_state(election)) == 1:
+            with transaction.atomic():
+                # lock the election, ballots cannot be appended while the results are counted
+                election = Election.objects.select_for_update().get(id=election.id)
+                if abs(self.get_state(election)) != 1:
+                    # ended by a concurrent request
+                    return Response(status=status.HTTP_403_FORBIDDEN)
+                # add the votes of the counter shards to the results
+                merge_counters(election)
+                if election.ledger:
+                    # count the remaining ballots and check the results against the ledger before publishing them
+                    while tally_ballots(election.id) > 0:
+                        pass
+                    if not verify_ballots(election):
+                        transaction.set_rollback(True)
+                        return Response({"error": "Results do not match the ballot ledger"},
+                                        status=status.HTTP_409_CONFLICT)
+                election.end_date = timezone.now()
+                election.paused = 0
+                election.save(update_fields=['end_date', 'paused'])
+                Voter.objects.filter(election_id=election.id).delete()
+            clear_ballot(election)
+            if config.REPORT_PREGENERATE:
+                # results are final now, render and store the report
+                election.refresh_from_db()
+                try:
+                    get_report(election)
+                except ReportUnavailable:
+                    # report is rendered on the first download instead
+                    pass
+                except Exception:
+                    # the election has ended anyway, the report is rendered again on the first download
+                    logger.exception('report of election %s could not be pregenerated', election.id)
             return Response(status=status.HTTP_200_OK)
         return Response(status=status.HTTP_403_FORBIDDEN)
 
@@ -298,9 +396,10 @@ class PauseElection(ElectionAPI):
             # logged in user does not own the requested election
             return Response(status=status.HTTP_403_FORBIDDEN)
         # pausing election only possible when it is in progress
-        if abs(self.get_state(election.id)) == 1:
+        if abs(self.get_state(election)) == 1:
             election.paused = (election.paused - 1) * (-1)
-            election.save()
+            election.save(update_fields=['paused'])
+            clear_ballot(election)
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(status=status.HTTP_403_FORBIDDEN)
 
@@ -316,13 +415,16 @@ class VoteReminder(ElectionAPI):
             # logged in user does not own the requested election
             return Response(status=status.HTTP_403_FORBIDDEN)
         # sending remind templates only possible while election in progress/paused
-        if abs(self.get_state(election.id)) == 1:
-            send_emails(Voter.objects.filter(election_id=election.id, voted=0), election, True)
+        if abs(self.get_state(election)) == 1:
+            queue_emails(Voter.objects.filter(election_id=election.id, voted=0), election, True)
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(status=status.HTTP_403_FORBIDDEN)
 
 
 class PDFResults(ElectionAPI):
+    # GET requests may read from a replica
+    replica_reads = True
+
     def get(self, request, election_id):
         if not request.user.is_authenticated:
             # user is not logged in
@@ -333,35 +435,85 @@ class PDFResults(ElectionAPI):
             # logged in user does not own the requested election
             return Response(status=status.HTTP_403_FORBIDDEN)
         # results only available if election already ended
-        if self.get_state(election.id) == 2:
+        if self.get_state(election) == 2:
             filename = 'Report_' + datetime.date.today().strftime('%d-%m-%Y')
-            results = {}
-            for option in Option.objects.filter(election_id=election.id).order_by('-votes', 'name').values():
-                results[option.get('name')] = option.get('votes')
-
-            # get pdf response, set filename and return HttpResponse
-            response = create_report(results, election)
-            response['Content-Disposition'] = 'inline; filename=' + filename
+            # results never change once the election is closed, serve the stored report
+            try:
+                report = get_report(election)
+            except ReportUnavailable as e:
+                # too many reports at the same time, the client should try again later
+                return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                headers={'Retry-After': '10'})
+            etag = '"%d-%s"' % (election.id, report.version)
+            last_modified = int(report.creation_date.timestamp())
+            # report not changed since the last download of the client
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = HttpResponse(bytes(report.pdf), content_type='application/pdf;')
+                response['Content-Disposition'] = 'inline; filename=' + filename
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            patch_cache_control(response, private=True, no_cache=True)
             return response
 
         return Response(status=status.HTTP_403_FORBIDDEN)
 
 
+class ResultsExport(ElectionAPI):
+    def export(self, elections, fmt, filename, many=True):
+        # stream the results, so any number of elections can be exported
+        if fmt == 'csv':
+            response = StreamingHttpResponse(results_csv(elections), content_type='text/csv')
+        elif fmt == 'json':
+            response = StreamingHttpResponse(results_json(elections, many), content_type='application/json')
+        else:
+            raise Http404
+        response['Content-Disposition'] = 'attachment; filename=' + filename + '.' + fmt
+        return response
+
+    def get(self, request, election_id, fmt):
+        if not request.user.is_authenticated:
+            # user is not logged in
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+        # get the requested election and return it
+        election = self.get_admin_election(election_id, request.user)
+        if election is None:
+            # logged in user does not own the requested election
+            return Response(status=status.HTTP_403_FORBIDDEN)
+        # results only available if election already ended
+        if self.get_state(election) == 2:
+            filename = 'Results_' + str(election.id)
+            return self.export(Election.objects.filter(id=election.id), fmt, filename, many=False)
+        return Response(status=status.HTTP_403_FORBIDDEN)
+
+
+class ResultsExportList(ResultsExport):
+    def get(self, request, fmt):
+        if not request.user.is_authenticated:
+            # user is not logged in
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+        # results of all closed elections of the logged in user
+        elections = Election.objects.filter(owner=request.user, end_date__isnull=False)
+        filename = 'Results_' + datetime.date.today().strftime('%d-%m-%Y')
+        return self.export(elections, fmt, filename)
+
+
 class OptionList(ElectionAPI):
     def post(self, request, election_id):
         if not request.user.is_authenticated:
             # user is not logged in
             return Response(status=status.HTTP_401_UNAUTHORIZED)
-        if self.get_admin_election(election_id, request.user) is None:
+        election = self.get_admin_election(election_id, request.user)
+        if election is None:
             # user does not own the requested election
             return Response(status=status.HTTP_403_FORBIDDEN)
         # creating options is only possible when election not has started yet
-        if self.get_state(election_id) == 0:
+        if self.get_state(election) == 0:
             # create a new election with data from the payload
             serializer = OptionSerializer(data=request.data)
             if serializer.is_valid():
                 options = request.data.get('options')
-                ret = {'options': []}
+                ret = {'options': [], 'option_ids': []}
                 for option in options:
                     serializer = OptionDetailSerializer(data={"name": option})
                     if serializer.is_valid():
@@ -369,52 +521,75 @@ class OptionList(ElectionAPI):
                             serializer.save(election_id=election_id)
                         except ValidationError:
                             pass
-                for option in Option.objects.filter(election_id=election_id).values():
-                    ret['options'].append(option['name'])
+                clear_ballot(election)
+                for option_id, name in Option.objects.filter(election_id=election_id).values_list('id', 'name'):
+                    ret['options'].append(name)
+                    ret['option_ids'].append(option_id)
                 return Response(ret, status=status.HTTP_200_OK)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         return Response(status=status.HTTP_403_FORBIDDEN)
 
 
 class OptionDetail(ElectionAPI):
-    def put(self, request, election_id, index):
+    def put(self, request, election_id, index=None, option_id=None):
         if not request.user.is_authenticated:
             # user is not logged in
             return Response(status=status.HTTP_401_UNAUTHORIZED)
-        if self.get_admin_election(election_id, request.user) is None:
+        election = self.get_admin_election(election_id, request.user)
+        if election is None:
             # user does not own the requested election
             return Response(status=status.HTTP_403_FORBIDDEN)
         # updating options is only possible when election not has started yet
-        if self.get_state(election_id) == 0:
+        if self.get_state(election) == 0:
             # get the requested option and update it with data in payload
-            option = self.get_option(election_id, index)
+            option = self.get_option(election_id, index, option_id)
             serializer = OptionSerializer(option, data=request.data)
             if serializer.is_valid():
                 serializer.save()
+                clear_ballot(election)
                 return Response(status=status.HTTP_204_NO_CONTENT)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         return Response(status=status.HTTP_403_FORBIDDEN)
 
-    def delete(self, request, election_id, index):
+    def delete(self, request, election_id, index=None, option_id=None):
         if not request.user.is_authenticated:
             # user is not logged in
             return Response(status=status.HTTP_401_UNAUTHORIZED)
-        if self.get_admin_election(election_id, request.user) is None:
+        election = self.get_admin_election(election_id, request.user)
+        if election is None:
             # user does not own the requested election
             return Response(status=status.HTTP_403_FORBIDDEN)
         # deleting options is only possible when election not has started yet
-        if self.get_state(election_id) == 0:
+        if self.get_state(election) == 0:
             # get the requested option and delete it
-            option = self.get_option(election_id, index)
+            option = self.get_option(election_id, index, option_id)
             option.delete()
-            ret = {'options': []}
-            for option in Option.objects.filter(election_id=election_id).values():
-                ret['options'].append(option['name'])
+            clear_ballot(election)
+            ret = {'options': [], 'option_ids': []}
+            for option_id, name in Option.objects.filter(election_id=election_id).values_list('id', 'name'):
+                ret['options'].append(name)
+                ret['option_ids'].append(option_id)
             return Response(ret, status=status.HTTP_200_OK)
         return Response(status=status.HTTP_403_FORBIDDEN)
 
 
 class VoterList(ElectionAPI):
+    def get(self, request, election_id):
+        if not request.user.is_authenticated:
+            # user is not logged in
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+        election = self.get_admin_election(election_id, request.user)
+        if election is None:
+            # user does not own the requested election
+            return Response(status=status.HTTP_403_FORBIDDEN)
+        # one page of voters, e.g. ?search=a&voted=false&after=a@example.com
+        serializer = VoterQuerySerializer(data=request.query_params.dict())
+        if serializer.is_valid():
+            ret = serializer.get_page(election)
+            ret['count'] = election.voters
+            return Response(ret, status=status.HTTP_200_OK)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
     def post(self, request, election_id):
         if not request.user.is_authenticated:
             # user is not logged in
@@ -424,51 +599,106 @@ class VoterList(ElectionAPI):
             # user does not own the requested election
             return Response(status=status.HTTP_403_FORBIDDEN)
 
-        state = self.get_state(election.id)
+        state = self.get_state(election)
         # add voters as long as election not ended
         if state == 2:
             return Response(status=status.HTTP_403_FORBIDDEN)
-        serializer = VoterSerializer(data=request.data)
+        serializer = VoterImportSerializer(data=request.data)
         # correct list of values
         if serializer.is_valid():
-            fails = {}
-            new_voters = []
-            voters = request.data.get('voters')
-            # for each email in the voters list
-            for voter in voters:
-                # check if email is valid
-                serializer = VoterDetailSerializer(data={"email": voter})
-                if serializer.is_valid():
-                    # save new voter
-                    try:
-                        serializer.save(election_id=election.id)
-                        # if election already in progress, we need to send later the links
-                        if abs(state) == 1:
-                            new_voters.append(Voter.objects.get(election_id=election.id,
-                                                                email=serializer.data.get('email')))
-                        election.voters = election.voters + 1
-                        election.save()
-                    # email already existing for this election
-                    except ValidationError:
-                        pass
-                else:
-                    pass
+            report = self.add_voters(election, state, serializer)
+            # return the number of added and rejected voters, the voters are listed page by page
+            ret = {
+                'added': len(report.get('accepted')),
+                'rejected': len(report.get('rejected')),
+                'voters': election.voters
+            }
+            return Response(ret, status=status.HTTP_200_OK)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class VoterImport(ElectionAPI):
+    def post(self, request, election_id):
+        if not request.user.is_authenticated:
+            # user is not logged in
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+        election = self.get_admin_election(election_id, request.user)
+        if election is None:
+            # user does not own the requested election
+            return Response(status=status.HTTP_403_FORBIDDEN)
 
-            # if election already in progress, send the links
-            if abs(state) == 1:
-                send_emails(new_voters, election)
-            # return voter list
-            ret = {'voters': []}
-            for voter in Voter.objects.filter(election_id=election_id).values():
-                ret['voters'].append(voter['email'])
+        state = self.get_state(election)
+        # add voters as long as election not ended
+        if state == 2:
+            return Response(status=status.HTTP_403_FORBIDDEN)
+        serializer = VoterImportSerializer(data=request.data)
+        # correct list of values
+        if serializer.is_valid():
+            # return which emails were accepted and which rejected (and why)
+            ret = self.add_voters(election, state, serializer)
+            ret['voters'] = election.voters
             return Response(ret, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class VoterUpload(ElectionAPI):
+    def import_roster(self, election, state, file):
+        ret = {'processed': 0, 'accepted': 0, 'rejected': 0}
+        emails = read_roster(file)
+        try:
+            while True:
+                # add the voters of the roster batch by batch
+                batch = list(itertools.islice(emails, config.VOTER_IMPORT_BATCH_SIZE))
+                if len(batch) == 0:
+                    break
+                rejected = {}
+                serializer = VoterImportSerializer(data={'voters': batch})
+                if not serializer.is_valid():
+                    # values which are no text at all (e.g. too long or with null characters), import the others
+                    errors = serializer.errors.get('voters')
+                    invalid = set(errors) if isinstance(errors, dict) else set(range(len(batch)))
+                    rejected = {batch[index]: 'invalid' for index in invalid}
+                    serializer = VoterImportSerializer(
+                        data={'voters': [email for index, email in enumerate(batch) if index not in invalid]})
+                    serializer.is_valid()
+                report = self.add_voters(election, state, serializer)
+                rejected.update(report.get('rejected'))
+                # report progress after every batch, every email of the batch is either accepted or rejected
+                # (an email rejected more than once is only listed once)
+                ret['processed'] += len(batch)
+                ret['accepted'] += len(report.get('accepted'))
+                ret['rejected'] += len(batch) - len(report.get('accepted'))
+                yield json.dumps(dict(ret, batch={'rejected': rejected})) + '\n'
+        except (csv.Error, UnicodeDecodeError, ValueError, zipfile.BadZipFile) as e:
+            # file is not a valid csv or xlsx roster
+            yield json.dumps(dict(ret, error=str(e))) + '\n'
+            return
+        ret['voters'] = election.voters
+        yield json.dumps(ret) + '\n'
+
+    def post(self, request, election_id):
+        if not request.user.is_authenticated:
+            # user is not logged in
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+        election = self.get_admin_election(election_id, request.user)
+        if election is None:
+            # user does not own the requested election
+            return Response(status=status.HTTP_403_FORBIDDEN)
+
+        state = self.get_state(election)
+        # add voters as long as election not ended
+        if state == 2:
+            return Response(status=status.HTTP_403_FORBIDDEN)
+        file = request.FILES.get('file')
+        if file is None or not file.name.lower().endswith(('.csv', '.xlsx')):
+            return Response({"file": ["A csv or xlsx file is required."]}, status=status.HTTP_400_BAD_REQUEST)
+        # stream the progress as one json line per batch
+        return StreamingHttpResponse(self.import_roster(election, state, file),
+                                     content_type='application/x-ndjson')
+
+
 class VoterDetail(ElectionAPI):
     def get_voter(self, election_id, email):
-        # try to get election, http404 if it does not exist
-        self.get_election(election_id)
         # get voter for requested election and email, http4 if not existing
         try:
             return Voter.objects.filter(election_id=election_id).get(email=email)
@@ -485,14 +715,64 @@ class VoterDetail(ElectionAPI):
             return Response(status=status.HTTP_403_FORBIDDEN)
 
         # delete voters as long as election has not ended
-        if self.get_state(election_id) == 0:
+        if self.get_state(election) == 0:
             # get requested voter and delete it
             voter = self.get_voter(election_id, email)
             voter.delete()
             election.voters = election.voters - 1
-            election.save()
-            ret = {'voters': []}
-            for voter in Voter.objects.filter(election_id=election_id).values():
-                ret['voters'].append(voter['email'])
-            return Response(ret, status=status.HTTP_200_OK)
+            election.save(update_fields=['voters'])
+            return Response({'removed': 1, 'voters': election.voters}, status=status.HTTP_200_OK)
         return Response(status=status.HTTP_403_FORBIDDEN)
+
+
+def database(function):
+    # the orm is synchronous, the async views run their queries in a pool of threads (each with its own connection)
+    def run(*args, **kwargs):
+        # these threads get no request signals, close expired or broken connections like at the end of a request
+        close_old_connections()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)
+
+
+def vote(request, token):
+    # body of vote_async, lookup, cast and commit run in one database thread
+    view = VoteView()
+    voter = view.get_voter(token)
+    ballot = view.get_ballot(voter.election_id)
+    # only if election is in progress and voter has not voted yet, voting is allowed
+    if ballot.get('state') != 1 or voter.voted == 1:
+        if request.method == 'GET':
+            return JsonResponse({"voted": voter.voted}, status=status.HTTP_403_FORBIDDEN)
+        return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+
+    if request.method == 'GET':
+        return JsonResponse({key: value for key, value in ballot.items() if key not in ('state', 'ledger')})
+
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({"detail": "JSON parse error"}, status=status.HTTP_400_BAD_REQUEST)
+    serializer = VoteSerializer(data=data, options=ballot.get('option_ids'), votable=ballot.get('votable'))
+    # if all the provided votes are valid
+    if serializer.is_valid():
+        # count the whole ballot in one transaction
+        if not cast_vote(voter, serializer.validated_data.get('options'), ballot.get('ledger')):
+            # voter has already voted or election is not in progress anymore
+            return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+        return HttpResponse(status=status.HTTP_200_OK)
+    return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+async def vote_async(request, token):
+    # same as VoteView, but the request does not hold a thread while waiting for the database
+    if request.method not in ('GET', 'POST'):
+        return HttpResponseNotAllowed(['GET', 'POST'])
+    # one hand-off to the database threads per vote instead of one per query
+    return await database(vote)(request, token)
+
+
+# voters have no session, csrf_exempt would turn the view into a sync view
+vote_async.csrf_exempt = True
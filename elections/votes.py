@@ -0,0 +1,153 @@
+import random
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import F, Q, Sum
+from django.db.models.functions import Coalesce
+
+from elections.models import Ballot, Election, Option, Voter, VoteCounter
+from elex import config
+
+
+def create_counters(election):
+    # counter sharding is disabled
+    if config.VOTE_COUNTER_SHARDS <= 0:
+        return
+    # one set of shards for the voted count of the election and one for every option
+    option_ids = [None] + list(Option.objects.filter(election_id=election.id).values_list('id', flat=True))
+    VoteCounter.objects.bulk_create([
+        VoteCounter(election_id=election.id, option_id=option_id, shard=shard)
+        for option_id in option_ids
+        for shard in range(config.VOTE_COUNTER_SHARDS)
+    ])
+
+
+def merge_counters(election):
+    with transaction.atomic():
+        counters = VoteCounter.objects.filter(election_id=election.id)
+        # lock all shards, so no vote can be counted while merging
+        list(counters.select_for_update().values_list('id', flat=True))
+        # add the sum of all shards to the option votes and the voted count
+        for option_id, total in counters.values('option_id')\
+                .annotate(total=Sum('count')).values_list('option_id', 'total'):
+            if option_id is None:
+                Election.objects.filter(id=election.id).update(voted=F('voted') + total)
+            else:
+                Option.objects.filter(id=option_id).update(votes=F('votes') + total)
+        counters.delete()
+
+
+def count_votes(election):
+    # options of the election with the votes of all their shards (total)
+    return Option.objects.filter(election_id=election.id)\
+        .annotate(total=F('votes') + Coalesce(Sum('votecounter__count'), 0))
+
+
+def count_voted(election):
+    # shards only exist while the election is running
+    if config.VOTE_COUNTER_SHARDS <= 0 or election.start_date is None or election.end_date is not None:
+        return election.voted
+    shards = VoteCounter.objects.filter(election_id=election.id, option__isnull=True)\
+        .aggregate(total=Sum('count'))
+    return election.voted + (shards.get('total') or 0)
+
+
+def tally_ballots(election_id, batch_size=None):
+    if batch_size is None:
+        batch_size = config.TALLY_BATCH_SIZE
+    with transaction.atomic():
+        # lock the election before its ballots, in the same order as ending the election
+        list(Election.objects.select_for_update().filter(id=election_id).values_list('id', flat=True))
+        # lock the next batch of ballots which are not counted yet
+        ballots = list(Ballot.objects.select_for_update().filter(election_id=election_id, tallied=False)
+                       .order_by('id').values_list('id', 'options')[:batch_size])
+        if len(ballots) == 0:
+            return 0
+
+        votes = Counter()
+        for _, options in ballots:
+            votes.update(options)
+        # add the counted ballots to the election and its options
+        Election.objects.filter(id=election_id).update(voted=F('voted') + len(ballots))
+        for option_id, count in votes.items():
+            Option.objects.filter(id=option_id).update(votes=F('votes') + count)
+        Ballot.objects.filter(id__in=[ballot[0] for ballot in ballots]).update(tallied=True)
+    # return number of counted ballots
+    return len(ballots)
+
+
+def tally_elections(batch_size=None):
+    # one batch of every election with ballots which are not counted yet
+    election_ids = Ballot.objects.filter(tallied=False).values_list('election_id', flat=True).distinct()
+    return sum(tally_ballots(election_id, batch_size) for election_id in list(election_ids))
+
+
+def verify_ballots(election):
+    votes = Counter()
+    ballots = 0
+    for options in Ballot.objects.filter(election_id=election.id).values_list('options', flat=True).iterator():
+        ballots += 1
+        votes.update(options)
+    # the results must match the ledger exactly
+    if ballots != Election.objects.get(id=election.id).voted:
+        return False
+    for option_id, count in Option.objects.filter(election_id=election.id).values_list('id', 'votes'):
+        if votes.get(option_id, 0) != count:
+            return False
+    return True
+
+
+def _in_progress(voter):
+    # election must be in progress, checked without locking the election row
+    return Election.objects.filter(
+        id=voter.election_id, paused=0, start_date__isnull=False, end_date__isnull=True).exists()
+
+
+def _append_ballot(voter, option_ids):
+    Ballot.objects.create(election_id=voter.election_id, options=sorted(option_ids))
+    # checked after the insert, which waits for the lock of an ending election (foreign key to the election),
+    # so a ballot is never added to an election whose results are already counted
+    return _in_progress(voter)
+
+
+def _increase_counters(voter, option_ids):
+    if not _in_progress(voter):
+        return False
+    # increase one random shard of the election and of every voted option at once
+    return VoteCounter.objects.filter(
+        Q(option__isnull=True) | Q(option_id__in=option_ids),
+        election_id=voter.election_id, shard=random.randrange(config.VOTE_COUNTER_SHARDS)
+    ).update(count=F('count') + 1) > 0
+
+
+def _increase_votes(voter, option_ids):
+    # increase total number of people who voted, only while election is in progress
+    in_progress = Election.objects.filter(
+        id=voter.election_id, paused=0, start_date__isnull=False, end_date__isnull=True
+    ).update(voted=F('voted') + 1)
+    if in_progress == 0:
+        return False
+    # increase votes for all voted options at once
+    Option.objects.filter(election_id=voter.election_id, id__in=option_ids)\
+        .update(votes=F('votes') + 1)
+    return True
+
+
+def cast_vote(voter, option_ids, ledger=False):
+    # the rows are locked in the same order as when the election ends (election, counters, ballots, options
+    # and voters last), so a vote cannot deadlock with the end of its election
+    with transaction.atomic():
+        if ledger:
+            # append the ballot to the ledger, it is counted later by the tally command
+            counted = _append_ballot(voter, option_ids)
+        elif config.VOTE_COUNTER_SHARDS > 0 and _increase_counters(voter, option_ids):
+            # if the election has counter shards, increase them instead of the hot election and option rows
+            counted = True
+        else:
+            counted = _increase_votes(voter, option_ids)
+        # mark voter as voted, succeeds only once so double votes are impossible
+        if not counted or Voter.objects.filter(token=voter.token, voted=0).update(voted=1) == 0:
+            # election was paused or ended in the meantime or the voter has already voted, undo the vote
+            transaction.set_rollback(True)
+            return False
+    return True
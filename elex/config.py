@@ -23,3 +23,72 @@ EMAIL_REMIND_TEMPLATE = 'example.html'
 
 HOSTNAME = 'http://localhost'
 DEVELOPMENT = False
+
+# number of counter rows per option to spread votes of one election over (0 disables sharding)
+VOTE_COUNTER_SHARDS = 0
+
+# only append ballots to the ledger while voting, votes are counted by the tally command
+# (applies to the elections started afterwards, a running election keeps its mode)
+VOTE_LEDGER = False
+TALLY_BATCH_SIZE = 1000
+
+# number of voters added at once when uploading a roster file
+VOTER_IMPORT_BATCH_SIZE = 1000
+
+# check persistent database connections at the start of every request (see ELEX_DB_CONN_MAX_AGE)
+DB_HEALTH_CHECKS = True
+
+# serve the ballot page and the votes with the async view (run with an asgi server, e.g. uvicorn,
+# and persistent database connections, see ELEX_DB_CONN_MAX_AGE)
+ASYNC_VOTE = False
+
+# seconds the ballot page of an election is cached, it is cleared on changes but with a local-memory
+# cache only in the process which made the change
+BALLOT_CACHE_TIMEOUT = 60
+
+# seconds the logged in user and its profile are cached, they are cleared when the user is saved or deleted
+# but not by bulk updates (e.g. User.objects.filter(...).update(is_active=False)), which apply after the timeout
+USER_CACHE_TIMEOUT = 60
+
+# number of voters returned per page by the voter list, by default and at most
+VOTER_PAGE_SIZE = 100
+VOTER_PAGE_MAX = 1000
+
+# number of elections returned per page by the election list, by default and at most
+ELECTION_PAGE_SIZE = 20
+ELECTION_PAGE_MAX = 100
+
+# emails are queued in the outbox and sent by the send_emails command
+EMAIL_BATCH_SIZE = 100
+EMAIL_MAX_ATTEMPTS = 5
+# seconds until a failed email is sent again, doubled after every attempt
+EMAIL_RETRY_DELAY = 60
+# seconds an email is claimed by a worker, it is sent again when the worker has not recorded the result by then
+EMAIL_CLAIM_TIMEOUT = 300
+# number of parallel smtp connections and messages sent over one connection before reconnecting
+EMAIL_CONNECTIONS = 4
+EMAIL_MESSAGES_PER_CONNECTION = 100
+# maximum number of emails sent per second (0 for no limit)
+EMAIL_RATE = 0
+
+# render the pdf report already when the election ends
+REPORT_PREGENERATE = False
+# processes rendering pdf reports, maximum number of reports rendered or waiting and seconds to wait for one
+REPORT_WORKERS = 2
+REPORT_MAX_JOBS = 4
+REPORT_TIMEOUT = 60
+
+# record latency, sql queries and timed sections per view, served in the prometheus format at /metrics
+METRICS = True
+# token required to read /metrics (as "Authorization: Bearer <token>"), /metrics is not served without a token
+METRICS_TOKEN = ''
+# seconds between the writes of the metrics of a process to METRICS_DIR (see settings.py)
+METRICS_FLUSH_SECONDS = 5
+# add a Server-Timing header with the timings to every response
+METRICS_SERVER_TIMING = False
+
+# send the reads of the views with replica_reads to the replicas in ELEX_DB_REPLICAS
+REPLICA_READS = True
+# seconds the reads of a user go to the primary after a change, until the replicas have caught up
+# (stored in the session, so it applies to all workers and nodes)
+REPLICA_PIN_SECONDS = 10
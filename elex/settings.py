@@ -58,12 +58,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'elections.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'elections.middleware.CachedAuthenticationMiddleware',
+    'elections.middleware.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -76,7 +78,21 @@ if DEBUG:
     ]
     CORS_ALLOW_CREDENTIALS = True
 
-SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
+# sessions are stored in signed cookies by default, so they need neither the database nor the cache
+SESSION_ENGINE = os.getenv('ELEX_SESSION_ENGINE', 'django.contrib.sessions.backends.signed_cookies')
+
+# local memory cache for a single node, a shared backend (e.g. memcached or redis) for multiple nodes
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('ELEX_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('ELEX_CACHE_LOCATION', 'elex'),
+        'KEY_PREFIX': 'elex',
+    }
+}
+
+# directory shared by the worker processes of a node, each process stores its metrics there and /metrics
+# adds them up (set by gunicorn.conf.py), empty for the metrics of the serving process only
+METRICS_DIR = os.getenv('ELEX_METRICS_DIR', '')
 
 ROOT_URLCONF = 'elex.urls'
 
@@ -164,10 +180,31 @@ DATABASES = {
         'USER': os.getenv('ELEX_DB_USER'),
         'PASSWORD': os.getenv('ELEX_DB_PASSWORD'),
         'HOST': os.getenv('ELEX_DB_HOST'),
-        'PORT': os.getenv('ELEX_DB_PORT')
+        'PORT': os.getenv('ELEX_DB_PORT'),
+        # seconds a connection is kept open for the next requests (0 closes it after every request), the async
+        # vote view needs persistent connections, otherwise every vote opens a new connection in its thread
+        'CONN_MAX_AGE': int(os.getenv('ELEX_DB_CONN_MAX_AGE', '60'))
     }
 }
 
+# sqlite instead of mysql, e.g. for benchmarks without a database server
+if os.getenv('ELEX_DB_ENGINE') == 'sqlite3':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.getenv('ELEX_DB_NAME') or os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': DATABASES['default']['CONN_MAX_AGE']
+    }
+
+# read replicas, comma separated hosts with the same database, user and password as the primary
+# (with sqlite the files of the replicas, separate test databases so the routing can be tested locally)
+for i, replica in enumerate(filter(None, os.getenv('ELEX_DB_REPLICAS', '').split(','))):
+    if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+        DATABASES['replica%d' % i] = dict(DATABASES['default'], NAME=replica.strip())
+    else:
+        DATABASES['replica%d' % i] = dict(DATABASES['default'], HOST=replica.strip(), TEST={'MIRROR': 'default'})
+
+DATABASE_ROUTERS = ['elections.routers.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
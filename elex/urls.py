@@ -20,6 +20,7 @@ from django.shortcuts import render
 from django.conf.urls import url
 from django.http import HttpResponseRedirect
 
+from elections.views import Metrics
 from . import settings
 
 urlpatterns = []
@@ -32,6 +33,7 @@ urlpatterns.extend([
     url(r'^auth/', include('social_django.urls')),
     url(r'^auth/logout', LogoutView.as_view(),
         {'next_page': settings.LOGOUT_REDIRECT_URL}, name='logout'),
+    url(r'^metrics$', Metrics.as_view()),
     url(r'^.*$', lambda request: render(request, template_name='index.html')),
 ])
 
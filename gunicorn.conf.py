@@ -0,0 +1,64 @@
+# production server: gunicorn -c gunicorn.conf.py
+import multiprocessing
+import glob
+import os
+import sys
+import tempfile
+
+# ELEX_ASGI=1 serves elex.asgi with uvicorn workers (needed for ASYNC_VOTE), otherwise elex.wsgi with threads
+if os.getenv('ELEX_ASGI') == '1':
+    wsgi_app = 'elex.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'elex.wsgi:application'
+    worker_class = 'gthread'
+    threads = int(os.getenv('ELEX_THREADS', '4'))
+
+bind = os.getenv('ELEX_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('ELEX_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+# load the application once in the master, the workers share its memory (copy-on-write)
+preload_app = os.getenv('ELEX_PRELOAD', '1') == '1'
+# pdf reports wait up to REPORT_TIMEOUT seconds for rendering
+timeout = int(os.getenv('ELEX_TIMEOUT', '90'))
+graceful_timeout = 30
+keepalive = 5
+# restart the workers from time to time, spread so they do not restart at once
+max_requests = int(os.getenv('ELEX_MAX_REQUESTS', '10000'))
+max_requests_jitter = max_requests // 10
+accesslog = '-'
+# the workers store their metrics in this directory, /metrics adds them up
+os.environ.setdefault('ELEX_METRICS_DIR', os.path.join(tempfile.gettempdir(), 'elex_metrics'))
+
+
+def on_starting(server):
+    # counts of a previous run of the server are not added
+    for path in glob.glob(os.path.join(os.environ['ELEX_METRICS_DIR'], '*.json')):
+        os.remove(path)
+
+
+def when_ready(server):
+    # do not start serving if the database, migrations, cache or templates are not ready
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'elex.settings')
+    import django
+    from django.core.management import call_command
+    from django.core.management.base import CommandError
+    django.setup()
+    try:
+        call_command('selfcheck')
+    except CommandError as e:
+        server.log.error('Startup check failed: %s', e)
+        sys.exit(1)
+
+
+def post_fork(server, worker):
+    # every worker opens its own database connections
+    if 'django.db' in sys.modules:
+        from django.db import connections
+        connections.close_all()
+
+
+def worker_exit(server, worker):
+    # keep the counts of a worker which is restarted (max_requests) or stopped
+    if 'elections.metrics' in sys.modules:
+        from elections.metrics import flush_metrics
+        flush_metrics()